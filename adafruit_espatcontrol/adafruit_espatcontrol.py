@@ -33,14 +33,17 @@ Implementation Notes
 """
 
 import gc
+import json
+import random
 import time
 
 from digitalio import DigitalInOut, Direction
 
 try:
-    from typing import Dict, List, Optional, Union
+    from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
     import busio
+    from circuitpython_typing import ReadableBuffer, WriteableBuffer
 except ImportError:
     pass
 
@@ -52,6 +55,577 @@ class OKError(Exception):
     """The exception thrown when we didn't get acknowledgement to an AT command"""
 
 
+# What a step of an operation yields when it's only waiting for data, with
+# nothing half read, so other asyncio tasks may run commands, see ESP_ATcontrol._run()
+_IDLE = -1
+
+# What the module answers a command with, and then drops it, when it arrives
+# while an earlier command is still running
+_BUSY_LINE = b"busy p...\r\n"
+
+
+class ResponseRule:
+    """Describes how the reply to an AT command ends and whether it succeeded.
+
+    :param terminators: byte strings that end the reply as soon as one arrives
+    :param accept: byte strings that make the reply a success even without a
+        trailing OK, the whole reply is then returned as-is
+    :param busy: byte strings that mean the module was busy, so the command
+        is retried even if it ended with OK
+    """
+
+    def __init__(
+        self,
+        terminators: Tuple[bytes, ...] = (b"OK\r\n", b"ERROR\r\n", b"ERR CODE:"),
+        accept: Tuple[bytes, ...] = (),
+        busy: Tuple[bytes, ...] = (),
+    ) -> None:
+        self.terminators = tuple(terminators)
+        self.accept = tuple(accept)
+        self.busy = tuple(busy)
+        self.markers = self.accept + self.busy
+
+    def matcher(self) -> "_Matcher":
+        """A fresh incremental matcher for one reply"""
+        return _Matcher(self.terminators, self.markers)
+
+
+class _Matcher:
+    """Look for the first of several terminators in a growing response, only
+    scanning the bytes that arrived since the previous search. Optional
+    markers are remembered if they show up anywhere before the terminator"""
+
+    def __init__(self, terminators: Tuple[bytes, ...], markers: Tuple[bytes, ...] = ()) -> None:
+        self.terminators = terminators
+        self.markers = markers
+        self._overlap = max(len(term) for term in terminators + markers) - 1
+        self._scanned = 0
+        self._found = {}
+        self.end = -1
+
+    def search(self, response: bytearray) -> int:
+        """Return the index just past the earliest terminator, or -1 if none yet"""
+        start = max(0, self._scanned - self._overlap)
+        window = bytes(response[start:])
+        self._scanned = len(response)
+        for marker in self.markers:
+            if marker not in self._found:
+                idx = window.find(marker)
+                if idx >= 0:
+                    self._found[marker] = start + idx + len(marker)
+        for term in self.terminators:
+            idx = window.find(term)
+            if idx >= 0 and (self.end < 0 or start + idx + len(term) < self.end):
+                self.end = start + idx + len(term)
+        return self.end
+
+    def seen(self, markers: Tuple[bytes, ...]) -> bool:
+        """Whether any of 'markers' arrived before the terminator (if any)"""
+        for marker in markers:
+            found = self._found.get(marker, -1)
+            if found >= 0 and (self.end < 0 or found <= self.end):
+                return True
+        return False
+
+
+class RetryPolicy:
+    """How often to retry something that failed, and how long to wait in between.
+
+    The wait after the n-th failure is 'delay' * 'backoff' ** (n - 1), capped at
+    'max_delay', then shortened at random by up to 'jitter' of itself so that
+    retries from several devices spread out.
+
+    :param attempts: most tries in total, None for no limit
+    :param float delay: seconds to wait after the first failure
+    :param float backoff: factor the wait grows by after each further failure
+    :param float max_delay: longest single wait, in seconds
+    :param float jitter: fraction (0 to 1) of each wait that is randomized
+    :param deadline: seconds after which we stop retrying, None for no limit
+    :param report: called as report(name, attempts, slept) when a retried call
+        finishes, with the number of tries and total seconds spent sleeping
+    """
+
+    def __init__(
+        self,
+        attempts: Optional[int] = 3,
+        delay: float = 1,
+        backoff: float = 1,
+        max_delay: float = 30,
+        jitter: float = 0,
+        deadline: Optional[float] = None,
+        report: Optional[Callable[[str, int, float], None]] = None,
+    ) -> None:
+        self.attempts = attempts
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.report = report
+
+    def start(self, name: str, attempts: Optional[int] = None) -> "_Retry":
+        """Begin one retried call of 'name', optionally with its own attempt limit"""
+        return _Retry(self, name, self.attempts if attempts is None else attempts)
+
+    def wait_time(self, failures: int) -> float:
+        """Seconds to wait after 'failures' failed tries in a row"""
+        wait = min(self.delay * self.backoff ** (failures - 1), self.max_delay)
+        if self.jitter:
+            wait -= wait * self.jitter * random.random()
+        return wait
+
+
+class _Retry:
+    """The state of one call being retried under a RetryPolicy"""
+
+    def __init__(self, policy: RetryPolicy, name: str, attempts: Optional[int]) -> None:
+        self.policy = policy
+        self.name = name
+        self.attempts = attempts
+        self.failures = 0
+        self.slept = 0
+        self._stamp = time.monotonic()
+
+    def next_delay(self) -> Optional[float]:
+        """Record a failure and return how long to wait before trying again,
+        or None (after reporting) if the policy says to give up"""
+        self.failures += 1
+        wait = None
+        if self.attempts is None or self.failures < self.attempts:
+            wait = self.policy.wait_time(self.failures)
+            if self.policy.deadline is not None:
+                left = self.policy.deadline - (time.monotonic() - self._stamp)
+                wait = min(wait, left) if left > 0 else None
+        if wait is None:
+            self.done(False)
+        else:
+            self.slept += wait
+        return wait
+
+    def sleep(self) -> bool:
+        """Record a failure and wait, False if we should give up instead"""
+        wait = self.next_delay()
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def done(self, succeeded: bool = True) -> None:
+        """Report how the call went, once it's over"""
+        if self.policy.report:
+            self.policy.report(self.name, self.failures + succeeded, self.slept)
+
+
+class DNSCache:
+    """Remembers what nslookup() found, so polling the same host doesn't cost
+    an AT+CIPDOMAIN round trip every time. Holds up to 'size' hosts and evicts
+    the least recently used one first. Failed lookups are remembered too, for
+    a shorter time, and raise their error again.
+
+    :param int size: most hosts to remember, 0 turns caching off
+    :param float ttl: seconds an address is used for
+    :param float negative_ttl: seconds a failed lookup is remembered for
+    """
+
+    def __init__(self, size: int = 8, ttl: float = 300, negative_ttl: float = 10) -> None:
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # host -> (expiry time, address or (exception type, args))
+        self._order = []  # hosts, least recently used first
+
+    def get(self, host: str) -> Union[str, None]:
+        """The cached address of 'host', or None if we have to look it up.
+        A cached failure is raised again"""
+        entry = self._entries.get(host)
+        if entry and time.monotonic() >= entry[0]:
+            self._drop(host)
+            entry = None
+        if not entry:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._order.remove(host)
+        self._order.append(host)
+        if isinstance(entry[1], tuple):
+            # a new one each time, raising the same one would grow its traceback
+            kind, args = entry[1]
+            raise kind(*args)
+        return entry[1]
+
+    def put(self, host: str, result: Union[str, Exception]) -> None:
+        """Remember an address, or the error looking it up raised"""
+        if not self.size:
+            return
+        if host in self._entries:
+            self._drop(host)
+        elif len(self._order) >= self.size:
+            self._drop(self._order[0])
+        if isinstance(result, Exception):
+            ttl, result = self.negative_ttl, (type(result), result.args)
+        else:
+            ttl = self.ttl
+        self._entries[host] = (time.monotonic() + ttl, result)
+        self._order.append(host)
+
+    def flush(self) -> None:
+        """Forget everything, the counters are kept"""
+        self._entries.clear()
+        self._order.clear()
+
+    def _drop(self, host: str) -> None:
+        del self._entries[host]
+        self._order.remove(host)
+
+
+class TLSConfig:
+    """Settings for TYPE_SSL connections. The SNI and ALPN are sent to the
+    module just before an SSL AT+CIPSTART, and only when they differ from what
+    that link already has, so repeated connections don't repeat the commands.
+    The buffer size is set by begin().
+
+    :param int buffer_size: TLS buffer size for AT+CIPSSLSIZE (ESP8266 only)
+    :param sni: server name for AT+CIPSSLCSNI, True for the host we connect to,
+        None to leave the module's setting alone
+    :param alpn: protocols to offer with AT+CIPSSLCALPN, such as ("http/1.1",)
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = 4096,
+        sni: Union[str, bool, None] = None,
+        alpn: Optional[Tuple[str, ...]] = None,
+    ) -> None:
+        self.buffer_size = buffer_size
+        self.sni = sni
+        self.alpn = alpn
+
+
+class _IPDHeader:
+    """Parses what follows "+IPD," as the bytes arrive, each byte looked at once:
+    <len>: or <link ID>,<len>: in single or multi-link mode, with ,"<remote IP>",
+    <remote port> before the colon when AT+CIPDINFO=1. In passive receive mode
+    the header ends the line instead, as a notice without data. It stops at the first byte
+    that can't be part of a header, without consuming it, so a new "+IPD," right
+    after a truncated one is still found"""
+
+    MAX_SIZE = 64  # longer than any real header, even with an IPv6 address
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        """Get ready for a new header"""
+        self.fields = []
+        self._field = bytearray()
+        self._quoted = False
+        self._size = 0
+        self.done = False
+        self.failed = False
+        self.notice = False
+
+    @property
+    def finished(self) -> bool:
+        """Whether the header is complete or turned out not to be one"""
+        return self.done or self.failed
+
+    def feed(self, data: memoryview) -> int:
+        """Parse bytes from 'data' until the header is finished, returns how many
+        of them belong to it"""
+        for used, byte in enumerate(data):
+            self._size += 1
+            if self._size > self.MAX_SIZE:
+                self.failed = True
+            elif self._quoted:
+                if byte == 0x22:  # closing quote
+                    self._quoted = False
+                else:
+                    self._field.append(byte)
+            elif byte == 0x22 and not self._field:
+                self._quoted = True
+            elif 0x30 <= byte <= 0x39 or byte == 0x2E:  # digits, or dots in an IP
+                self._field.append(byte)
+            elif byte in {0x2C, 0x3A}:  # , or :
+                self.fields.append(bytes(self._field))
+                self._field = bytearray()
+                if byte == 0x3A:
+                    self.done = self._valid()
+                    self.failed = not self.done
+                    return used + 1
+                self.failed = len(self.fields) > 3
+            elif byte == 0x0D:  # passive mode notice
+                self.fields.append(bytes(self._field))
+                self.notice = True
+                self.done = self._valid()
+                self.failed = not self.done
+                return used + 1
+            else:
+                self.failed = True
+            if self.failed:
+                return used
+        return len(data)
+
+    def _valid(self) -> bool:
+        if len(self.fields) not in {1, 2, 3, 4}:
+            return False
+        numbers = self.fields[: 2 - len(self.fields) % 2] + self.fields[len(self.fields) - 1 :]
+        return all(field.isdigit() for field in numbers)
+
+    @property
+    def link_id(self) -> int:
+        """The link the data arrived on, 0 in single-link mode"""
+        return int(self.fields[0]) if len(self.fields) % 2 == 0 else 0
+
+    @property
+    def length(self) -> int:
+        """How many bytes of data follow the header"""
+        return int(self.fields[1 - len(self.fields) % 2])
+
+    @property
+    def remote(self) -> Union[Tuple[str, int], None]:
+        """(IP, port) the data came from, if AT+CIPDINFO=1 told us"""
+        if len(self.fields) < 3:
+            return None
+        return (str(self.fields[-2], "utf-8"), int(self.fields[-1]))
+
+
+class Passthrough:
+    """Transparent transmission (AT+CIPMODE=1) over the open connection, see
+    ESP_ATcontrol.passthrough(). Inside the with block the UART is a raw pipe to
+    the remote end, with no AT+CIPSEND or +IPD framing: write() sends, read() and
+    readinto() receive. Leaving the block sends the +++ escape with the quiet
+    time it needs around it. bytes_read, bytes_written and throughput then tell
+    how fast it went, to compare with the framed socket_send()/socket_receive()
+
+    :param esp: the ESP_ATcontrol with a single link connection open
+    :param float timeout: how long read() and readinto() wait for data
+    """
+
+    GUARD_TIME = 1  # seconds of silence after +++, before the next AT command
+    ESCAPE_GAP = 0.05  # seconds of silence before +++, so it arrives on its own
+
+    def __init__(self, esp: "ESP_ATcontrol", timeout: float = 1) -> None:
+        self._esp = esp
+        self.timeout = timeout
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.elapsed = 0
+        self._stamp = None
+
+    def __enter__(self) -> "Passthrough":
+        esp = self._esp
+        if esp.multi_link:
+            raise RuntimeError("Passthrough only works in single link mode")
+        esp.at_response("AT+CIPMODE=1", timeout=3)
+        try:
+            esp.at_response("AT+CIPSEND", timeout=5, retries=1)
+            prompt = esp._reader.read_until(_Matcher((b">",)), self.timeout)
+            if prompt[-1:] != b">":
+                raise RuntimeError("Didn't get data prompt for passthrough")
+        except (RuntimeError, OKError):
+            esp.at_response("AT+CIPMODE=0", timeout=3)
+            raise
+        self.bytes_read = self.bytes_written = 0
+        self._stamp = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        esp = self._esp
+        self.elapsed = time.monotonic() - self._stamp
+        time.sleep(self.ESCAPE_GAP)
+        esp._uart.write(b"+++")
+        time.sleep(self.GUARD_TIME)
+        # anything still coming in is raw data nobody is going to read
+        esp._reader.reset_input_buffer()
+        esp.at_response("AT+CIPMODE=0", timeout=3)
+
+    def write(self, buffer: ReadableBuffer) -> int:
+        """Send all of 'buffer', returns how many bytes that was"""
+        self._esp._uart.write(buffer)
+        self.bytes_written += len(buffer)
+        return len(buffer)
+
+    def readinto(self, buffer: WriteableBuffer, nbytes: int = 0) -> int:
+        """Read up to 'nbytes' (all of 'buffer' if 0) into 'buffer', waiting up
+        to the timeout for the first byte, returns the count"""
+        view = memoryview(buffer)
+        if nbytes:
+            view = view[:nbytes]
+        got = 0
+        stamp = time.monotonic()
+        while not got and (time.monotonic() - stamp) < self.timeout:
+            got = self._esp._reader.readinto(view)
+        self.bytes_read += got
+        return got
+
+    def read(self, nbytes: int) -> bytes:
+        """Read up to 'nbytes', see readinto()"""
+        buffer = bytearray(nbytes)
+        return bytes(buffer[: self.readinto(buffer)])
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second moved either way, so far or for the whole block"""
+        elapsed = self.elapsed or (time.monotonic() - self._stamp if self._stamp else 0)
+        return (self.bytes_read + self.bytes_written) / elapsed if elapsed else 0
+
+
+class _UARTReader:
+    """Reads the UART in bulk into a preallocated ring buffer. Anything read
+    past the end of a response stays buffered for the next reader, so every
+    read loop in the driver must go through here rather than the UART"""
+
+    def __init__(self, uart: busio.UART, size: int = 1024, flow=None) -> None:
+        self._uart = uart
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._size = size
+        self._head = 0  # index of the oldest buffered byte
+        self._count = 0  # number of buffered bytes
+        self._flow = flow
+        # (prefix, handler) for frames that must be pulled out of any reply,
+        # handler(timeout) returns the steps that read the rest of the frame
+        self.divert = None
+
+    @property
+    def in_waiting(self) -> int:
+        """Number of bytes buffered here or waiting in the UART"""
+        return self._count + self._uart.in_waiting
+
+    def fill(self) -> int:
+        """Move whatever the UART has waiting into the ring buffer, returns
+        the number of bytes moved"""
+        waiting = self._uart.in_waiting
+        if not waiting:
+            if self._flow:
+                self._flow(True)
+            return 0
+        if self._flow:
+            self._flow(False)
+        moved = 0
+        while waiting and self._count < self._size:
+            tail = (self._head + self._count) % self._size
+            chunk = min(waiting, self._size - self._count, self._size - tail)
+            got = self._uart.readinto(self._view[tail : tail + chunk])
+            if not got:
+                break
+            self._count += got
+            moved += got
+            waiting -= got
+        return moved
+
+    def take(self, out: bytearray) -> int:
+        """Append every buffered byte to 'out', returns how many were added"""
+        taken = self._count
+        while self._count:
+            chunk = min(self._count, self._size - self._head)
+            out += self._view[self._head : self._head + chunk]
+            self._head = (self._head + chunk) % self._size
+            self._count -= chunk
+        return taken
+
+    def unread(self, nbytes: int) -> None:
+        """Give back the last 'nbytes' handed out by take(). Only valid before
+        the next fill(), while those bytes are still in the ring"""
+        self._head = (self._head - nbytes) % self._size
+        self._count += nbytes
+
+    def readinto(self, buf) -> int:
+        """Read up to len(buf) bytes into buf without blocking, returns the count.
+        Once the ring is empty the rest comes from the UART straight into buf"""
+        want = len(buf)
+        got = 0
+        while got < want:
+            if not self._count:
+                waiting = self._uart.in_waiting
+                if self._flow:
+                    self._flow(not waiting)
+                if not waiting:
+                    break
+                chunk = min(want - got, waiting)
+                more = self._uart.readinto(memoryview(buf)[got : got + chunk])
+                if not more:
+                    break
+                got += more
+                continue
+            chunk = min(want - got, self._count, self._size - self._head)
+            buf[got : got + chunk] = self._view[self._head : self._head + chunk]
+            self._head = (self._head + chunk) % self._size
+            self._count -= chunk
+            got += chunk
+        return got
+
+    def read(self, nbytes: int) -> bytes:
+        """Read up to 'nbytes' bytes without blocking"""
+        buf = bytearray(nbytes)
+        return bytes(buf[: self.readinto(buf)])
+
+    def parse(self, parser: _IPDHeader) -> bool:
+        """Feed buffered bytes to 'parser' until it's finished, consuming only
+        the ones it used. Returns True once it's finished"""
+        self.fill()
+        while self._count and not parser.finished:
+            chunk = min(self._count, self._size - self._head)
+            used = parser.feed(self._view[self._head : self._head + chunk])
+            self._head = (self._head + used) % self._size
+            self._count -= used
+            if not self._count:
+                self.fill()
+        return parser.finished
+
+    def read_until(self, matcher: _Matcher, timeout: float, divert: bool = True) -> bytes:
+        """Collect bytes until one of the matcher's terminators shows up or we
+        time out. The reply ends with the terminator, bytes after it stay buffered.
+        Diverted frames found along the way are handed to their handler instead"""
+        response = bytearray()
+        stamp = time.monotonic()
+        while (time.monotonic() - stamp) < timeout:
+            step = self.read_step(matcher, response, timeout, divert)
+            if step is True:
+                break
+            if step:
+                for _ in step:  # pull in the diverted frame
+                    pass
+        return bytes(response)
+
+    def read_step(
+        self, matcher: _Matcher, response: bytearray, timeout: float, divert: bool = True
+    ) -> Union[bool, Iterator]:
+        """One pass of read_until() that never blocks. Returns True once 'response'
+        ends with a terminator. At a diverted frame it consumes the prefix and
+        returns the handler's steps, which must run before the next pass"""
+        self.fill()
+        scanned = len(response)
+        if not self.take(response):
+            return False
+        cut = -1
+        if divert and self.divert:
+            prefix = self.divert[0]
+            start = max(0, scanned - len(prefix) + 1)
+            cut = bytes(response[start:]).find(prefix)
+            if cut >= 0:
+                cut += start
+                self.unread(len(response) - cut)
+                del response[cut:]
+        end = matcher.search(response)
+        if end >= 0:
+            self.unread(len(response) - end)
+            del response[end:]
+            return True
+        if cut >= 0:
+            self.read(len(self.divert[0]))
+            return self.divert[1](timeout)
+        return False
+
+    def reset_input_buffer(self) -> None:
+        """Throw away anything buffered here and in the UART"""
+        self._head = self._count = 0
+        self._uart.reset_input_buffer()
+
+
 class ESP_ATcontrol:
     """A wrapper for AT commands to a connected ESP8266 or ESP32 module to do
     some very basic internetting. The ESP module must be pre-programmed with
@@ -78,6 +652,91 @@ class ESP_ATcontrol:
 
     USER_AGENT = "esp-idf/1.0 esp32"
 
+    # Lines the module sends on its own, see add_urc_callback()
+    URCS = (
+        b"CLOSED",
+        b"CONNECT",
+        b"CONNECT FAIL",
+        b"WIFI CONNECTED",
+        b"WIFI GOT IP",
+        b"WIFI DISCONNECT",
+        b"ready",
+        b"SEND OK",
+        b"SEND FAIL",
+    )
+
+    # Commands that change the connection status, so its cache must be dropped
+    STATUS_COMMANDS = (
+        "AT+CIPSTART",
+        "AT+CIPCLOSE",
+        "AT+CWJAP=",
+        "AT+CWJEAP=",
+        "AT+CWQAP",
+        "AT+CWMODE=",
+        "AT+RST",
+        "AT+RESTORE",
+    )
+
+    # Commands that join or leave an access point, so cached DNS answers go
+    AP_COMMANDS = ("AT+CWJAP=", "AT+CWJEAP=", "AT+CWQAP", "AT+RST", "AT+RESTORE")
+
+    # How the reply to each command ends, keyed by command prefix, "" is the default
+    RESPONSE_RULES = {
+        "": ResponseRule((b"OK\r\n", b"ERROR\r\n", b"ERR CODE:", b"WIFI CONNECTED\r\n")),
+        # AT+CWJAP= and AT+CWJEAP= do not return an ok :P
+        "AT+CWJAP=": ResponseRule(
+            (b"OK\r\n", b"ERROR\r\n", b"ERR CODE:", b"WIFI GOT IP\r\n"),
+            accept=(b"WIFI GOT IP\r\n",),
+        ),
+        "AT+CWJEAP=": ResponseRule(
+            (b"OK\r\n", b"ERROR\r\n", b"ERR CODE:", b"WIFI GOT IP\r\n"),
+            accept=(b"WIFI GOT IP\r\n",),
+        ),
+        "AT+CWQAP": ResponseRule(
+            (b"OK\r\n", b"ERROR\r\n", b"ERR CODE:", b"WIFI CONNECTED\r\n"),
+            accept=(b"WIFI DISCONNECT",),
+        ),
+        # ping also does not return an OK
+        "AT+PING": ResponseRule(
+            (b"OK\r\n", b"ERROR\r\n", b"ERR CODE:", b"WIFI CONNECTED\r\n"),
+            accept=(b"ERROR\r\n",),
+        ),
+        # does return OK but in fact it is busy
+        "AT+CIFSR": ResponseRule(
+            (b"OK\r\n", b"ERROR\r\n", b"ERR CODE:", b"WIFI CONNECTED\r\n"),
+            busy=(b"busy",),
+        ),
+    }
+
+    # Link IDs 0 to MAX_LINKS - 1 exist in multi-connection mode
+    MAX_LINKS = 5
+
+    # Most data one AT+CIPSEND takes on many firmware builds
+    SEND_CHUNK_SIZE = 2048
+
+    # Size of the buffer iter_receive() yields from, one full TCP segment
+    RX_CHUNK_SIZE = 1460
+
+    # Baudrates negotiate_baudrate() tries, slowest first
+    BAUDRATE_CANDIDATES = (115200, 230400, 460800, 921600, 1500000, 2000000)
+
+    # AT+GMR round trips that must all come back intact at a candidate baudrate
+    BAUDRATE_TEST_ROUNDS = 3
+
+    # Commands in a row that get no reply at all before resync() drops the
+    # negotiated baudrate a step
+    DESYNC_LIMIT = 3
+
+    # How failures are retried, keyed by AT command prefix or method name,
+    # "" is the default for AT commands
+    RETRY_POLICIES = {
+        "": RetryPolicy(),
+        # waits for the access point before opening a socket
+        "socket_connect": RetryPolicy(attempts=None),
+        "begin": RetryPolicy(attempts=3, delay=0),
+        "connect_enterprise": RetryPolicy(attempts=None, delay=0),
+    }
+
     def __init__(
         self,
         uart: busio.UART,
@@ -88,10 +747,62 @@ class ESP_ATcontrol:
         reset_pin: Optional[DigitalInOut] = None,
         debug: bool = False,
         use_cipstatus: bool = False,
+        quiet_chars: Optional[int] = 8,
+        status_ttl: float = 1,
+        retry_policy: Optional[RetryPolicy] = None,
+        passive_receive: bool = False,
+        multi_link: bool = False,
+        dns_cache: Optional[DNSCache] = None,
+        link_pool_size: int = 0,
+        link_idle_timeout: float = 30,
+        tls_config: Optional[TLSConfig] = None,
+        negotiate_baudrate: bool = False,
+        capability_cache: Optional[str] = None,
     ):
         """This function doesn't try to do any sync'ing, just sets up
-        # the hardware, that way nothing can unexpectedly fail!"""
+        # the hardware, that way nothing can unexpectedly fail!
+
+        Before each command, pending input is read and handed to its URC
+        callbacks and receive queues until the line has been idle for
+        'quiet_chars' character times. Set it to None for the old fixed 100ms
+        wait and flush, which throws that input away.
+
+        The connection status is cached for 'status_ttl' seconds, or until a
+        command or unsolicited result changes it. Set it to 0 to always ask.
+
+        'retry_policy' replaces the default RetryPolicy for AT commands, see
+        set_retry_policy() for overriding it per command.
+
+        With 'passive_receive' begin() puts the module in passive receive mode
+        (AT+CIPRECVMODE=1): received TCP data waits on the module until we ask
+        for it, so nothing overflows the UART even without flow control.
+
+        With 'multi_link' begin() turns on multi-connection mode (AT+CIPMUX=1),
+        so up to MAX_LINKS sockets can be open at once, each on its own link ID.
+
+        'dns_cache' replaces the default DNSCache that nslookup() answers from,
+        it's flushed whenever we join or leave an access point.
+
+        With 'link_pool_size' up to that many connections are kept open when
+        their socket is closed, for the next socket to the same host, port and
+        conntype to reuse, see park_link(). Those idle for 'link_idle_timeout'
+        seconds are closed.
+
+        'tls_config' replaces the default TLSConfig for SSL connections.
+
+        With 'negotiate_baudrate' the first begin() looks for the fastest of
+        BAUDRATE_CANDIDATES that works over this wiring instead of using
+        'run_baudrate', see negotiate_baudrate(). If the module later stops
+        answering at it, resync() falls back to the next slower one.
+
+        'capability_cache' is the path of a small JSON file where begin() saves
+        what it found out about the module: which probes its firmware fails and
+        the negotiated baudrate. The next begin() with the same firmware version
+        skips those probes and starts at that baudrate. The file is only written
+        when something changed, and only if the filesystem is writable."""
         self._uart = uart
+        self._reader = _UARTReader(uart, flow=self.hw_flow)
+        self._reader.divert = (b"+IPD,", self._receive_ipd_steps)
         if not run_baudrate:
             run_baudrate = default_baudrate
         self._default_baudrate = default_baudrate
@@ -110,48 +821,182 @@ class ESP_ATcontrol:
         self._debug = debug
         self._versionstrings = []
         self._version = None
-        self._ipdpacket = bytearray(1500)
+        self._rx_queues = {}  # link ID -> list of received payloads
+        self._rx_into = None  # (link ID, memoryview) +IPD payloads go straight into
+        self._rx_into_got = 0
+        self._rx_closed = set()  # link IDs the remote end closed
+        self._rx_notified = set()  # link IDs with data waiting in passive mode
+        self._rx_sources = {}  # UDP link ID -> (IP, port) of each queued datagram
+        self._ipd_info = False  # whether AT+CIPDINFO=1 took
+        self._passive_receive = passive_receive
+        self._sending = None  # link ID waiting for SEND OK or SEND FAIL
+        self._send_timeout = 1
+        self._send_failed = set()  # link IDs whose last send got SEND FAIL
+        self._multi_link = multi_link
+        self._links = set()  # link IDs handed out by allocate_link()
+        self._link_types = {}  # link ID -> conntype of its open connection
+        self._link_pool_size = link_pool_size
+        self._link_idle_timeout = link_idle_timeout
+        self._parked = []  # (host, port, conntype), link ID, time parked; oldest first
+        self._tls_config = tls_config or TLSConfig()
+        self._tls_links = {}  # link ID -> (SNI, ALPN) the module has for it
+        self._handshake_times = {}  # link ID -> seconds its SSL AT+CIPSTART took
+        self._rx_chunk = None  # reused by iter_receive()
+        self._ipd_header = _IPDHeader()
+        self._urc_callbacks = {}
         self._ifconfig = []
         self._initialized = False
         self._conntype = None
         self._use_cipstatus = use_cipstatus
+        self._response_rules = dict(self.RESPONSE_RULES)
+        self._retry_policies = dict(self.RETRY_POLICIES)
+        if retry_policy:
+            self._retry_policies[""] = retry_policy
+        self._dns_cache = dns_cache or DNSCache()
+        self._quiet_chars = quiet_chars
+        self._status_ttl = status_ttl
+        self._status_cache = None
+        self._status_stamp = None  # None when the cache is stale
+        self._needs_resync = False
+        self._negotiate_baudrate = negotiate_baudrate
+        self._baudrate_negotiated = False
+        self._desyncs = 0  # commands in a row that got no reply at all
+        self._capability_path = capability_cache
+        self._capabilities = None  # as loaded from or saved to capability_cache
+        self._supported = {}  # probe name -> whether begin() found it works
 
     def begin(self) -> None:
         """Initialize the module by syncing, resetting if necessary, setting up
-        the desired baudrate, turning on single-socket mode, and configuring
+        the desired baudrate, turning on single or multi-socket mode, and configuring
         SSL support. Required before using the module but we dont do in __init__
         because this can throw an exception."""
         # Connect and sync
-        for _ in range(3):
+        retry = self.retry_policy("begin").start("begin")
+        self._forget_links()
+        cache = self._load_capabilities()
+        # a baudrate negotiated on an earlier boot, only used while we still negotiate
+        saved_baudrate = cache.get("baudrate") if self._negotiate_baudrate else None
+        while True:
             try:
-                if not self.sync() and not self.soft_reset():
+                if (
+                    not self.sync()
+                    and not self._sync_saved_baudrate(saved_baudrate)
+                    and not self.soft_reset()
+                ):
                     self.hard_reset()
                     self.soft_reset()
                 self.echo(False)
-                # set flow control if required
-                self.baudrate = self._run_baudrate
-                # get and cache versionstring
-                self.get_version()
-                if self.cipmux != 0:
-                    self.cipmux = 0
+                if saved_baudrate and not self._baudrate_negotiated:
+                    self._run_baudrate = saved_baudrate
+                    self._baudrate_negotiated = True
+                # set flow control if required. A module answering at a run baudrate
+                # other than its default got there, flow control and all, through an
+                # AT+UART_CUR of ours it hasn't been reset since
+                warm = self._default_baudrate != self._run_baudrate == self._uart.baudrate
                 try:
-                    self.at_response("AT+CIPSSLSIZE=4096", retries=1, timeout=3)
-                except OKError:
+                    if not warm:
+                        self.baudrate = self._run_baudrate
+                except RuntimeError:
+                    if not saved_baudrate:
+                        raise
+                    # the saved baudrate doesnt work anymore, find another
+                    self._recover_baudrate(self._default_baudrate)
+                    self._run_baudrate = self._default_baudrate
+                    self._baudrate_negotiated = False
+                    saved_baudrate = None
+                    cache = {}
+                if self._negotiate_baudrate and not self._baudrate_negotiated:
+                    self.negotiate_baudrate()
+                    self._baudrate_negotiated = True
+                # get and cache versionstring, and probe the rest in one round trip,
+                # less whatever the capability cache says this firmware lacks.
+                # AT+CIPDINFO=1 adds the sender to +IPD, for socket_receive_from()
+                probes = {
+                    "sslsize": "AT+CIPSSLSIZE=%d" % self._tls_config.buffer_size,
+                    "cwstate": "AT+CWSTATE?",
+                    "dinfo": "AT+CIPDINFO=1",
+                }
+                commands = ["AT+GMR", "AT+CIPMUX?"]
+                commands += [cmd for name, cmd in probes.items() if cache.get(name, True)]
+                replies = self.at_pipeline(commands, timeout=3, retries=1, strict=False)
+                replies = dict(zip(commands, replies))
+                gmr, cipmux = replies["AT+GMR"], replies["AT+CIPMUX?"]
+                if gmr is None or cipmux is None:
+                    raise OKError("No OK response to AT+GMR or AT+CIPMUX?")
+                self._parse_gmr(gmr)
+                if cache and cache.get("version") != self._version:
+                    # the firmware changed, so probe what the cache had us skip
+                    cache = {}
+                    skipped = [cmd for cmd in probes.values() if cmd not in replies]
+                    if skipped:
+                        again = self.at_pipeline(skipped, timeout=3, retries=1, strict=False)
+                        replies.update(zip(skipped, again))
+                for name, cmd in probes.items():
+                    self._supported[name] = replies.get(cmd) is not None
+                self._ipd_info = self._supported["dinfo"]
+                if self._parse_cipmux(cipmux) != self._multi_link:
+                    self.at_response("AT+CIPMUX=%d" % self._multi_link, timeout=3)
+                if not self._supported["sslsize"] and not cache:
                     # ESP32 doesnt use CIPSSLSIZE, its ok!
                     self.at_response("AT+CIPSSLCCONF?")
 
-                try:
-                    self.at_response("AT+CWSTATE?", retries=1, timeout=3)
-                except OKError:
+                if not self._supported["cwstate"]:
                     # ESP8285's use CIPSTATUS and have no CWSTATE or CWIPSTATUS functions
                     self._use_cipstatus = True
                     if self._debug:
                         print("No CWSTATE support, using CIPSTATUS, it's ok!")
 
+                if self._passive_receive:
+                    self.at_response("AT+CIPRECVMODE=1", timeout=3)
+
                 self._initialized = True
+                self._needs_resync = False
+                self._save_capabilities()
+                retry.done()
                 return
             except OKError:
-                pass  # retry
+                if not retry.sleep():
+                    return
+
+    def _load_capabilities(self) -> Dict[str, Union[str, int, bool]]:
+        """What an earlier begin() saved in the capability cache, if anything"""
+        if self._capabilities is None:
+            self._capabilities = {}
+            if self._capability_path:
+                try:
+                    with open(self._capability_path) as file:
+                        self._capabilities = json.load(file)
+                except (OSError, ValueError):
+                    pass  # nothing saved yet, or it got mangled
+        return self._capabilities
+
+    def _save_capabilities(self) -> None:
+        """Write what begin() found out to the capability cache, if it changed"""
+        if not self._capability_path:
+            return
+        capabilities = dict(self._supported, version=self._version)
+        if self._baudrate_negotiated:
+            capabilities["baudrate"] = self._run_baudrate
+        if capabilities == self._capabilities:
+            return  # spare the flash
+        try:
+            with open(self._capability_path, "w") as file:
+                json.dump(capabilities, file)
+            self._capabilities = capabilities
+        except OSError as error:  # read-only unless boot.py remounted it
+            if self._debug:
+                print("Couldn't save capabilities:", error)
+
+    def _sync_saved_baudrate(self, baudrate: Optional[int]) -> bool:
+        """Try the saved baudrate, the module is still at it if only we were reset"""
+        if not baudrate or baudrate == self._uart.baudrate:
+            return False
+        self._uart.baudrate = baudrate
+        self._reader.reset_input_buffer()
+        if self.sync():
+            return True
+        self._uart.baudrate = self._default_baudrate
+        return False
 
     def connect(
         self, secrets: Dict[str, Union[str, int]], timeout: int = 15, retries: int = 3
@@ -164,29 +1009,30 @@ class ESP_ATcontrol:
         try:
             if not self._initialized:
                 self.begin()
-            AP = self.remote_AP
-            if AP[0] != secrets["ssid"]:
-                self.join_AP(
-                    secrets["ssid"],
-                    secrets["password"],
-                    timeout=timeout,
-                    retries=retries,
-                )
-                print("Connected to", secrets["ssid"])
-                if "timezone" in secrets:
-                    tzone = secrets["timezone"]
-                    ntp = None
-                    if "ntp_server" in secrets:
-                        ntp = secrets["ntp_server"]
-                    self.sntp_config(True, tzone, ntp)
-                print("My IP Address:", self.local_ip)
-            else:
-                print("Already connected to", AP[0])
-            return  # yay!
+            self._run(self._connect_steps(secrets, timeout, retries))
         except (RuntimeError, OKError) as exp:
             print("Failed to connect\n", exp)
             raise
 
+    def _connect_steps(
+        self, secrets: Dict[str, Union[str, int]], timeout: int, retries: int
+    ) -> Iterator:
+        AP = yield from self._remote_ap_steps()
+        if AP[0] != secrets["ssid"]:
+            yield from self._join_ap_steps(secrets["ssid"], secrets["password"], timeout, retries)
+            print("Connected to", secrets["ssid"])
+            commands = ["AT+CIFSR"]
+            if "timezone" in secrets:
+                tzone = secrets["timezone"]
+                ntp = None
+                if "ntp_server" in secrets:
+                    ntp = secrets["ntp_server"]
+                commands.insert(0, self._sntp_command(True, tzone, ntp))
+            replies = yield from self._at_pipeline_steps(commands)
+            print("My IP Address:", self._parse_cifsr(replies[-1]))
+        else:
+            print("Already connected to", AP[0])
+
     def connect_enterprise(
         self, secrets: Dict[str, Union[str, int]], timeout: int = 15, retries: int = 3
     ) -> None:
@@ -198,6 +1044,7 @@ class ESP_ATcontrol:
         retries = 3
         if self._debug:
             print("In connect_enterprise()")
+        retry = self.retry_policy("connect_enterprise").start("connect_enterprise")
         while True:
             try:
                 if not self._initialized or retries == 0:
@@ -226,11 +1073,14 @@ class ESP_ATcontrol:
                         self.sntp_config(True, tzone, ntp)
                     print("Connected to", self.remote_AP[0])
                     print("My IP Address:", self.local_ip)
+                retry.done()
                 return  # yay!
             except (RuntimeError, OKError) as exp:
+                if not retry.sleep():
+                    print("Failed to connect\n", exp)
+                    raise
                 print("Failed to connect, retrying\n", exp)
                 retries -= 1
-                continue
 
     def set_autoconnect(self, autoconnect: bool) -> None:
         """Set the auto connection status if the wifi connects automatically on powerup"""
@@ -245,12 +1095,146 @@ class ESP_ATcontrol:
     @property
     def cipmux(self) -> int:
         """The IP socket multiplexing setting. 0 for one socket, 1 for multi-socket"""
-        replies = self.at_response("AT+CIPMUX?", timeout=3).split(b"\r\n")
-        for reply in replies:
-            if reply.startswith(b"+CIPMUX:"):
-                return int(reply[8:])
+        return self._parse_cipmux(self.at_response("AT+CIPMUX?", timeout=3))
+
+    def _parse_cipmux(self, reply: bytes) -> int:
+        for line in reply.split(b"\r\n"):
+            if line.startswith(b"+CIPMUX:"):
+                return int(line[8:])
         raise RuntimeError("Bad response to CIPMUX?")
 
+    @property
+    def multi_link(self) -> bool:
+        """Whether we use multi-connection mode, see allocate_link()"""
+        return self._multi_link
+
+    def allocate_link(self) -> int:
+        """Reserve a free link ID for a new connection, always 0 in single link
+        mode where every socket shares the one connection"""
+        return self._run(self._allocate_link_steps())
+
+    def _allocate_link_steps(self) -> Iterator:
+        if not self._multi_link:
+            return 0
+        for link_id in range(self.MAX_LINKS):
+            if link_id not in self._links:
+                self._links.add(link_id)
+                return link_id
+        if self._parked:
+            # make room by closing the connection parked longest
+            link_id = self._parked[0][1]
+            yield from self._close_parked_steps(0)
+            self._links.add(link_id)
+            return link_id
+        raise RuntimeError("All %d links are in use" % self.MAX_LINKS)
+
+    def release_link(self, link_id: int) -> None:
+        """Give back a link ID from allocate_link() once its socket is closed"""
+        self._links.discard(link_id)
+
+    def park_link(self, link_id: int, remote: str, remote_port: int) -> bool:
+        """Keep the connection on a link from allocate_link() open instead of
+        closing it, for take_parked_link() to hand out again. From then on the
+        link ID is the pool's. If the link pool is off or the connection is
+        gone, it's closed and released now and we return False. Beyond
+        'link_pool_size' the connection parked longest is closed, and so is
+        one that gets any data while parked"""
+        return self._run(self._park_link_steps(link_id, remote, remote_port))
+
+    def _park_link_steps(self, link_id: int, remote: str, remote_port: int) -> Iterator:
+        yield from self._expire_parked_steps()
+        conntype = self._link_types.get(link_id)
+        if (
+            not self._link_pool_size
+            or not conntype
+            or link_id in self._rx_closed
+            or link_id in self._rx_notified  # unread data waits on the module
+        ):
+            yield from self._socket_disconnect_steps(link_id)
+            self.release_link(link_id)
+            return False
+        self._unpark(link_id)
+        if len(self._parked) >= self._link_pool_size:
+            yield from self._close_parked_steps(0)
+        # whatever the last user left unread isn't for the next one
+        self._drop_received(link_id)
+        self._parked.append(((remote, remote_port, conntype), link_id, time.monotonic()))
+        return True
+
+    def take_parked_link(
+        self, remote: str, remote_port: int, conntype: Optional[str] = None
+    ) -> Optional[int]:
+        """The link ID of a parked connection to 'remote' that is still open,
+        which is then the caller's to use and release, or None if there's none"""
+        return self._run(self._take_parked_link_steps(remote, remote_port, conntype))
+
+    def _take_parked_link_steps(
+        self, remote: str, remote_port: int, conntype: Optional[str]
+    ) -> Iterator:
+        if not self._parked:
+            return None
+        yield from self._flush_input_steps()  # hear about any CLOSED first
+        yield from self._expire_parked_steps()
+        key = (remote, remote_port, self._resolve_conntype(conntype, remote_port))
+        for index, (parked, link_id, _) in enumerate(self._parked):
+            if parked == key:
+                del self._parked[index]
+                return link_id
+        return None
+
+    def _expire_parked_steps(self) -> Iterator:
+        """Close parked connections that idled too long, that the remote end
+        closed, or that got data while parked, which the next user mustn't read"""
+        now = time.monotonic()
+        index = 0
+        while index < len(self._parked):
+            _, link_id, stamp = self._parked[index]
+            if (
+                link_id in self._rx_closed
+                or self._rx_queues.get(link_id)
+                or link_id in self._rx_notified
+                or now - stamp >= self._link_idle_timeout
+            ):
+                yield from self._close_parked_steps(index)
+            else:
+                index += 1
+
+    def _close_parked_steps(self, index: int) -> Iterator:
+        _, link_id, _ = self._parked.pop(index)
+        if link_id in self._rx_closed:
+            self._link_types.pop(link_id, None)  # nothing left to close
+            self._drop_received(link_id)
+        else:
+            yield from self._socket_disconnect_steps(link_id)
+        self.release_link(link_id)
+
+    def _forget_links(self) -> None:
+        """The module restarted, so every connection on it is gone. Parked links
+        go back to the free ones, links sockets still hold read as closed"""
+        for _, link_id, _ in self._parked:
+            self.release_link(link_id)
+            self._drop_received(link_id)
+        self._parked = []
+        self._link_types.clear()
+        self._tls_links.clear()
+        self._conntype = None
+        self._rx_closed.update(self._links if self._multi_link else (0,))
+
+    def _unpark(self, link_id: int) -> bool:
+        """Forget any parked connection on a link that's being reused or closed,
+        returns whether there was one"""
+        parked = len(self._parked)
+        self._parked = [entry for entry in self._parked if entry[1] != link_id]
+        return len(self._parked) < parked
+
+    def _link_arg(self, link_id: int) -> str:
+        """The '<link ID>,' that starts socket command arguments in multi link mode"""
+        if self._multi_link:
+            return "%d," % link_id
+        if link_id:
+            raise RuntimeError("Link IDs other than 0 need multi_link mode")
+        return ""
+
     def socket_connect(
         self,
         conntype: str,
@@ -258,7 +1242,8 @@ class ESP_ATcontrol:
         remote_port: int,
         *,
         keepalive: int = 10,
-        retries: int = 1,
+        retries: Optional[int] = 1,
+        link_id: int = 0,
     ) -> bool:
         """Open a socket. conntype can be TYPE_TCP, TYPE_UDP, or TYPE_SSL. Remote
         can be an IP address or DNS (we'll do the lookup for you. Remote port
@@ -270,8 +1255,123 @@ class ESP_ATcontrol:
         is not provided.
 
         If requests are done using ESPAT_WiFiManager, the conntype is set there
-        depending on the protocol (http/https)."""
+        depending on the protocol (http/https).
+
+        While the access point isn't connected yet we wait and check again, as
+        the "socket_connect" retry policy allows. 'retries' is passed on to the
+        AT+CIPSTART at_response(), None leaves it up to the retry policy.
 
+        In multi link mode the socket is opened on 'link_id' and the other links
+        are left alone, otherwise any open socket is closed first.
+
+        A UDP link stays open for any number of socket_send() calls, each of
+        which may go to a different remote, see socket_receive_from() for
+        telling apart the datagrams that come back."""
+        return self._run(
+            self._socket_connect_steps(conntype, remote, remote_port, keepalive, retries, link_id)
+        )
+
+    def _socket_connect_steps(
+        self,
+        conntype: str,
+        remote: str,
+        remote_port: int,
+        keepalive: int,
+        retries: Optional[int],
+        link_id: int,
+    ) -> Iterator:
+        conntype = self._resolve_conntype(conntype, remote_port)
+        self._unpark(link_id)
+
+        if conntype == self.TYPE_UDP or link_id in self._link_types:
+            # always disconnect for TYPE_UDP, and reopen a link that's in use
+            yield from self._socket_disconnect_steps(link_id)
+        force = False
+        retry = self.retry_policy("socket_connect").start("socket_connect")
+        while True:
+            stat = yield from self._status_steps(force)
+            if stat in {self.STATUS_APCONNECTED, self.STATUS_SOCKETCLOSED}:
+                break
+            if stat == self.STATUS_SOCKETOPEN and self._multi_link:
+                break  # that's one of the other links
+            if stat == self.STATUS_SOCKETOPEN:
+                yield from self._socket_disconnect_steps(0)
+                continue
+            wait = retry.next_delay()
+            if wait is None:
+                raise RuntimeError("Not connected to an access point")
+            yield wait
+            force = True  # the cached status is what we're waiting out
+        if retry.failures:
+            retry.done()
+        if conntype == self.TYPE_SSL:
+            commands, wanted = self._tls_commands(link_id, remote)
+            for command in commands:
+                yield from self._at_response_steps(command, timeout=3)
+            self._tls_links[link_id] = wanted
+        self._drop_received(link_id)  # whatever came late for the last connection
+        if conntype == self.TYPE_UDP:
+            self._rx_sources[link_id] = []
+        cmd = self._cipstart_command(conntype, remote, remote_port, keepalive, link_id)
+        if self._debug is True:
+            print("socket_connect(): Going to send command")
+        stamp = time.monotonic()
+        reply = yield from self._at_response_steps(cmd, timeout=10, retries=retries)
+        if conntype == self.TYPE_SSL:
+            self._handshake_times[link_id] = time.monotonic() - stamp
+        connected = bytes(self._link_arg(link_id) + "CONNECT", "utf-8")
+        for line in reply.split(b"\r\n"):
+            if line != connected:
+                continue
+            if conntype != self.TYPE_UDP:
+                stat = yield from self._status_steps()
+                if stat != self.STATUS_SOCKETOPEN:
+                    continue
+            self._conntype = conntype
+            self._link_types[link_id] = conntype
+            return True
+
+        return False
+
+    def _tls_commands(self, link_id: int, remote: str) -> Tuple[List[str], Tuple]:
+        """The commands that bring the SNI and ALPN of a link in line with
+        tls_config, and the (SNI, ALPN) it then has"""
+        config = self._tls_config
+        sni = config.sni
+        if sni is True:
+            # an IP address is no server name
+            sni = None if remote.replace(".", "").isdigit() else remote
+        alpn = tuple(config.alpn or ())
+        old_sni, old_alpn = self._tls_links.get(link_id, (None, ()))
+        commands = []
+        if sni and sni != old_sni:
+            commands.append("AT+CIPSSLCSNI=" + self._link_arg(link_id) + '"' + sni + '"')
+        if alpn != old_alpn:
+            protocols = "".join(',"' + protocol + '"' for protocol in alpn)
+            commands.append(
+                "AT+CIPSSLCALPN=%s%d%s" % (self._link_arg(link_id), len(alpn), protocols)
+            )
+        return commands, (sni or old_sni, alpn)
+
+    @property
+    def tls_config(self) -> TLSConfig:
+        """The TLSConfig for SSL connections, a new one takes effect with the next
+        socket_connect() (its buffer_size with the next begin())"""
+        return self._tls_config
+
+    @tls_config.setter
+    def tls_config(self, config: TLSConfig) -> None:
+        self._tls_config = config
+
+    def handshake_time(self, link_id: int = 0) -> Union[float, None]:
+        """Seconds the AT+CIPSTART of the SSL connection on a link took, which is
+        mostly the TLS handshake, or None if it has no SSL connection"""
+        if self._link_types.get(link_id) != self.TYPE_SSL:
+            return None
+        return self._handshake_times.get(link_id)
+
+    def _resolve_conntype(self, conntype: Optional[str], remote_port: int) -> Optional[str]:
+        """The conntype to use when the caller may not have given one"""
         # if caller does not provide conntype, use default conntype from
         # object if set, otherwise fall back to old buggy logic
         if not conntype and self._conntype:
@@ -286,146 +1386,352 @@ class ESP_ATcontrol:
             # to cater for MQTT over TCP
             elif remote_port == 1883:
                 conntype = self.TYPE_TCP
+        return conntype
 
-        # lets just do one connection at a time for now
-        if conntype == self.TYPE_UDP:
-            # always disconnect for TYPE_UDP
-            self.socket_disconnect()
-        while True:
-            stat = self.status
-            if stat in {self.STATUS_APCONNECTED, self.STATUS_SOCKETCLOSED}:
-                break
-            if stat == self.STATUS_SOCKETOPEN:
-                self.socket_disconnect()
-            else:
-                time.sleep(1)
+    def _cipstart_command(
+        self, conntype: str, remote: str, remote_port: int, keepalive: int, link_id: int = 0
+    ) -> str:
         if conntype not in {self.TYPE_TCP, self.TYPE_UDP, self.TYPE_SSL}:
             raise RuntimeError("Connection type must be TCP, UDL or SSL")
-        cmd = (
-            'AT+CIPSTART="'
+        command = (
+            "AT+CIPSTART="
+            + self._link_arg(link_id)
+            + '"'
             + conntype
             + '","'
             + remote
             + '",'
             + str(remote_port)
-            + ","
-            + str(keepalive)
         )
-        if self._debug is True:
-            print("socket_connect(): Going to send command")
-        replies = self.at_response(cmd, timeout=10, retries=retries).split(b"\r\n")
-        for reply in replies:
-            if reply == b"CONNECT" and (
-                conntype in {self.TYPE_TCP, self.TYPE_SSL}
-                and self.status == self.STATUS_SOCKETOPEN
-                or conntype == self.TYPE_UDP
-            ):
-                self._conntype = conntype
-                return True
-
-        return False
+        if conntype == self.TYPE_UDP:
+            return command  # for UDP the next parameter is the local port
+        return command + "," + str(keepalive)
 
-    def socket_send(self, buffer: bytes, timeout: int = 1) -> bool:
-        """Send data over the already-opened socket, buffer must be bytes"""
-        cmd = "AT+CIPSEND=%d" % len(buffer)
-        self.at_response(cmd, timeout=5, retries=1)
-        prompt = b""
-        stamp = time.monotonic()
-        while (time.monotonic() - stamp) < timeout:
-            if self._uart.in_waiting:
-                prompt += self._uart.read(1)
-                self.hw_flow(False)
-                # print(prompt)
-                if prompt[-1:] == b">":
-                    break
-            else:
-                self.hw_flow(True)
-        if not prompt or (prompt[-1:] != b">"):
+    def socket_send(
+        self,
+        buffer: ReadableBuffer,
+        timeout: int = 1,
+        link_id: int = 0,
+        remote: Optional[Tuple[str, int]] = None,
+    ) -> int:
+        """Send data over the already-opened socket, returns how many bytes were sent.
+        TCP and SSL data longer than SEND_CHUNK_SIZE goes out in several AT+CIPSEND
+        commands, each one a slice of 'buffer' so nothing is copied. A UDP
+        datagram is always sent whole, to the (IP, port) in 'remote' if given
+        rather than the one the link was opened with.
+
+        Each chunk's SEND OK is waited for, and any reply data that races it is
+        kept for socket_receive(). If the module answers SEND FAIL, we return
+        how much went out before that chunk, or raise RuntimeError if nothing did"""
+        return self._run(self._socket_send_steps(buffer, timeout, link_id, remote))
+
+    def _socket_send_steps(
+        self,
+        buffer: ReadableBuffer,
+        timeout: float,
+        link_id: int,
+        remote: Optional[Tuple[str, int]],
+    ) -> Iterator:
+        view = memoryview(buffer)
+        udp = self._link_types.get(link_id) == self.TYPE_UDP
+        size = len(view) if udp else self.SEND_CHUNK_SIZE
+        # a send that was cancelled before its result came in isn't ours to report
+        yield from self._await_send_steps()
+        self._send_failed.discard(link_id)
+        sent = 0
+        while sent < len(view):
+            chunk = view[sent : sent + size]
+            yield from self._send_chunk_steps(chunk, timeout, link_id, remote)
+            # one chunk at a time, the module is busy until it said SEND OK
+            yield from self._await_send_steps()
+            if link_id in self._send_failed:
+                self._send_failed.discard(link_id)
+                if sent:
+                    return sent  # all but the chunk that failed, like socket.send()
+                raise RuntimeError("Failed to send data")
+            sent += len(chunk)
+        return sent
+
+    def _send_chunk_steps(
+        self,
+        chunk: memoryview,
+        timeout: float,
+        link_id: int,
+        remote: Optional[Tuple[str, int]] = None,
+    ) -> Iterator:
+        """One AT+CIPSEND, its SEND OK or SEND FAIL is left for _await_send_steps()"""
+        cmd = self._cipsend_command(len(chunk), link_id, remote)
+        yield from self._at_response_steps(cmd, timeout=5, retries=1)
+        prompt = yield from self._read_steps(_Matcher((b">",)), timeout)
+        if prompt[-1:] != b">":
             raise RuntimeError("Didn't get data prompt for sending")
-        self._uart.reset_input_buffer()
-        self._uart.write(buffer)
-        if self._conntype == self.TYPE_UDP:
-            return True
+        self._uart.write(chunk)
+        self._sending = link_id
+        self._send_timeout = timeout
+
+    def _cipsend_command(
+        self, length: int, link_id: int, remote: Optional[Tuple[str, int]] = None
+    ) -> str:
+        cmd = "AT+CIPSEND=" + self._link_arg(link_id) + str(length)
+        if remote:
+            cmd += ',"%s",%d' % remote
+        return cmd
+
+    def _await_send_steps(self) -> Iterator:
+        """Wait for the SEND OK or SEND FAIL of data we sent, if that's still
+        out. Any +IPD data or other URCs that come first are handled as usual"""
         stamp = time.monotonic()
-        response = b""
-        while (time.monotonic() - stamp) < timeout:
-            if self._uart.in_waiting:
-                response += self._uart.read(self._uart.in_waiting)
-                if response[-9:] == b"SEND OK\r\n":
-                    break
-                if response[-7:] == b"ERROR\r\n":
-                    break
-        if self._debug:
-            print("<---", response)
-        # Get newlines off front and back, then split into lines
-        return True
+        while self._sending is not None and (time.monotonic() - stamp) < self._send_timeout:
+            if self._reader.in_waiting:
+                yield from self._poll_input_steps(self._send_timeout)
+            else:
+                yield
+        self._sending = None  # if it never said, assume it went out
 
-    def socket_receive(self, timeout: int = 5) -> bytearray:
+    def socket_receive(self, timeout: int = 5, link_id: int = 0) -> bytearray:
         """Check for incoming data over the open socket, returns bytes"""
-        incoming_bytes = None
-        bundle = []
-        toread = 0
+        return self._run(self._socket_receive_steps(timeout, link_id))
+
+    def _socket_receive_steps(self, timeout: float, link_id: int) -> Iterator:
+        if self._passive_receive:
+            buffer = bytearray(self.RX_CHUNK_SIZE)
+            got = yield from self._socket_receive_into_steps(memoryview(buffer), timeout, link_id)
+            return buffer[:got]
         gc.collect()
-        i = 0  # index into our internal packet
+        queue = self._rx_queues.setdefault(link_id, [])
         stamp = time.monotonic()
-        ipd_start = b"+IPD,"
-        while (time.monotonic() - stamp) < timeout:
-            if self._uart.in_waiting:
+        while not queue and (time.monotonic() - stamp) < timeout:
+            if self._reader.in_waiting:
+                yield from self._poll_input_steps(timeout)
                 stamp = time.monotonic()  # reset timestamp when there's data!
-                if not incoming_bytes:
-                    self.hw_flow(False)  # stop the flow
-                    # read one byte at a time
-                    self._ipdpacket[i] = self._uart.read(1)[0]
-                    if chr(self._ipdpacket[0]) != "+":
-                        i = 0  # keep goin' till we start with +
-                        continue
-                    i += 1
-                    # look for the IPD message
-                    if (ipd_start in self._ipdpacket) and chr(self._ipdpacket[i - 1]) == ":":
-                        try:
-                            ipd = str(self._ipdpacket[5 : i - 1], "utf-8")
-                            incoming_bytes = int(ipd)
-                            if self._debug:
-                                print("Receiving:", incoming_bytes)
-                        except ValueError as err:
-                            raise RuntimeError("Parsing error during receive", ipd) from err
-                        i = 0  # reset the input buffer now that we know the size
-                    elif i > 20:
-                        i = 0  # Hmm we somehow didnt get a proper +IPD packet? start over
-                else:
-                    self.hw_flow(False)  # stop the flow
-                    # read as much as we can!
-                    toread = min(incoming_bytes - i, self._uart.in_waiting)
-                    # print("i ", i, "to read:", toread)
-                    self._ipdpacket[i : i + toread] = self._uart.read(toread)
-                    i += toread
-                    if i == incoming_bytes:
-                        # print(self._ipdpacket[0:i])
-                        gc.collect()
-                        bundle.append(self._ipdpacket[0:i])
-                        gc.collect()
-                        i = incoming_bytes = 0
-                        break  # We've received all the data. Don't wait until timeout.
             else:  # no data waiting
                 self.hw_flow(True)  # start the floooow
-        totalsize = sum(len(x) for x in bundle)
-        ret = bytearray(totalsize)
+                yield _IDLE
+        return self._take_queue(link_id)
+
+    def socket_receive_into(
+        self, buffer: WriteableBuffer, nbytes: int = 0, timeout: int = 5, link_id: int = 0
+    ) -> int:
+        """Wait for incoming data over the open socket and put up to 'nbytes'
+        of it (all of 'buffer' if 0) in 'buffer', returns how many bytes that was.
+        Payload bytes not already buffered by the reader go from the UART
+        straight into 'buffer', without copying. Returns 0 right away once the
+        socket is closed and everything was read"""
+        view = memoryview(buffer)
+        if nbytes:
+            view = view[:nbytes]
+        return self._run(self._socket_receive_into_steps(view, timeout, link_id))
+
+    def _socket_receive_into_steps(
+        self, view: memoryview, timeout: float, link_id: int
+    ) -> Iterator:
+        got = self._take_queue_into(link_id, view)
+        if got:
+            return got
+        if self._passive_receive:
+            return (yield from self._receive_passive_steps(link_id, view, timeout))
+        queue = self._rx_queues.setdefault(link_id, [])
+        stamp = time.monotonic()
+        while not queue and (time.monotonic() - stamp) < timeout:
+            if link_id in self._rx_closed and not self._reader.in_waiting:
+                break
+            if self._reader.in_waiting:
+                # a frame for this link goes straight into 'view'
+                self._rx_into = (link_id, view)
+                self._rx_into_got = 0
+                try:
+                    yield from self._poll_input_steps(timeout)
+                finally:
+                    self._rx_into = None
+                if self._rx_into_got:
+                    return self._rx_into_got
+                stamp = time.monotonic()  # reset timestamp when there's data!
+            else:
+                self.hw_flow(True)
+                yield _IDLE
+        return self._take_queue_into(link_id, view)
+
+    def _receive_passive_steps(self, link_id: int, view: memoryview, timeout: float) -> Iterator:
+        """socket_receive_into() for passive receive mode, asks the module how
+        much it holds and then pulls that straight into 'view'"""
+        queue = self._rx_queues.setdefault(link_id, [])
+        stamp = time.monotonic()
+        while True:
+            self._rx_notified.discard(link_id)
+            try:
+                reply = yield from self._at_response_steps("AT+CIPRECVLEN?", timeout=3, retries=1)
+                waiting = self._parse_ciprecvlen(reply)
+            except OKError:
+                waiting = []  # no connection left to ask about
+            size = waiting[link_id] if link_id < len(waiting) else 0
+            if size:
+                return (yield from self._receive_data_steps(link_id, view[:size], timeout))
+            # wait for a +IPD notice, data (UDP is never passive) or CLOSED
+            while link_id not in self._rx_notified and not queue:
+                if link_id in self._rx_closed or (time.monotonic() - stamp) >= timeout:
+                    return 0
+                if self._reader.in_waiting:
+                    yield from self._poll_input_steps(timeout)
+                    stamp = time.monotonic()
+                else:
+                    self.hw_flow(True)
+                    yield _IDLE
+            if queue:
+                return self._take_queue_into(link_id, view)
+
+    def _receive_data_steps(self, link_id: int, view: memoryview, timeout: float) -> Iterator:
+        """Pull len(view) bytes of passive mode data into 'view' with AT+CIPRECVDATA"""
+        yield from self._send_command_steps(
+            "AT+CIPRECVDATA=" + self._link_arg(link_id) + str(len(view))
+        )
+        # +CIPRECVDATA:<len>,<data> or, on older firmware, +CIPRECVDATA,<len>:<data>
+        reply = yield from self._read_steps(_Matcher((b"+CIPRECVDATA", b"ERROR\r\n")), timeout)
+        if reply[-12:] != b"+CIPRECVDATA":
+            self._dispatch_urcs(reply)
+            return 0
+        yield from self._read_steps(_Matcher((b",", b":")), timeout)  # the separator
+        length = yield from self._read_steps(_Matcher((b",", b":")), timeout)
+        if self._ipd_info and length[-1:] == b",":
+            # AT+CIPDINFO=1 puts "<IP>",<port>, before the data
+            yield from self._read_steps(_Matcher((b",",)), timeout)
+            yield from self._read_steps(_Matcher((b",",)), timeout)
+        got = yield from self._read_payload_steps(view[: min(int(length[:-1]), len(view))], timeout)
+        reply = yield from self._read_steps(_Matcher((b"OK\r\n", b"ERROR\r\n")), timeout)
+        self._dispatch_urcs(reply)
+        return got
+
+    @staticmethod
+    def _parse_ciprecvlen(response: bytes) -> List[int]:
+        for line in response.split(b"\r\n"):
+            if line.startswith(b"+CIPRECVLEN:"):
+                return [int(x) if x.strip() else 0 for x in line[12:].split(b",")]
+        raise RuntimeError("Bad response to CIPRECVLEN?")
+
+    def iter_receive(
+        self, timeout: int = 5, max_bytes: Optional[int] = None, link_id: int = 0
+    ) -> Iterator[memoryview]:
+        """Yield what arrives over the open socket as each +IPD frame completes,
+        until the socket is closed, 'max_bytes' have been read, or nothing came
+        for 'timeout' seconds. Every chunk is a memoryview into the same buffer,
+        so use or copy it before asking for the next one"""
+        if self._rx_chunk is None:
+            self._rx_chunk = bytearray(self.RX_CHUNK_SIZE)
+        buffer = self._rx_chunk
+        total = 0
+        while max_bytes is None or total < max_bytes:
+            want = len(buffer) if max_bytes is None else min(len(buffer), max_bytes - total)
+            got = self.socket_receive_into(buffer, want, timeout, link_id)
+            if not got:
+                return
+            total += got
+            yield memoryview(buffer)[:got]
+
+    def socket_receive_from(
+        self, buffer: WriteableBuffer, nbytes: int = 0, timeout: int = 5, link_id: int = 0
+    ) -> Tuple[int, Optional[Tuple[str, int]]]:
+        """Wait for one datagram on an open UDP link and put up to 'nbytes' of it
+        (all of 'buffer' if 0) in 'buffer', the rest is dropped like any UDP
+        socket would. Returns how many bytes that was and the (IP, port) it came
+        from, which is None if the firmware doesn't support AT+CIPDINFO"""
+        return self._run(self._socket_receive_from_steps(buffer, nbytes, timeout, link_id))
+
+    def _socket_receive_from_steps(
+        self, buffer: WriteableBuffer, nbytes: int, timeout: float, link_id: int
+    ) -> Iterator:
+        queue = self._rx_queues.setdefault(link_id, [])
+        stamp = time.monotonic()
+        while not queue and (time.monotonic() - stamp) < timeout:
+            if self._reader.in_waiting:
+                yield from self._poll_input_steps(timeout)
+            else:
+                self.hw_flow(True)
+                yield _IDLE
+        if not queue:
+            return 0, None
+        return self._take_datagram(link_id, buffer, nbytes)
+
+    def _take_datagram(
+        self, link_id: int, buffer: WriteableBuffer, nbytes: int
+    ) -> Tuple[int, Optional[Tuple[str, int]]]:
+        """Move the oldest queued datagram of a link into 'buffer'"""
+        datagram = self._rx_queues[link_id].pop(0)
+        sources = self._rx_sources.get(link_id)
+        source = sources.pop(0) if sources else None
+        view = memoryview(buffer)
+        if nbytes:
+            view = view[:nbytes]
+        size = min(len(view), len(datagram))
+        view[:size] = datagram[:size]
+        return size, source
+
+    def _take_queue_into(self, link_id: int, view: memoryview) -> int:
+        """Move as much of what was received on a link as fits into 'view'"""
+        queue = self._rx_queues.get(link_id)
+        got = 0
+        while queue and got < len(view):
+            chunk = queue[0]
+            size = min(len(chunk), len(view) - got)
+            view[got : got + size] = chunk[:size]
+            got += size
+            if size == len(chunk):
+                queue.pop(0)
+                if self._rx_sources.get(link_id):
+                    self._rx_sources[link_id].pop(0)
+            else:
+                queue[0] = memoryview(chunk)[size:]
+        return got
+
+    def _take_queue(self, link_id: int) -> bytearray:
+        """Everything received on a link so far, as one buffer"""
+        queue = self._rx_queues.setdefault(link_id, [])
+        if link_id in self._rx_sources:
+            self._rx_sources[link_id] = []
+        if len(queue) == 1 and isinstance(queue[0], bytearray):
+            return queue.pop()
+        ret = bytearray(sum(len(x) for x in queue))
         i = 0
-        for x in bundle:
-            for char in x:
-                ret[i] = char
-                i += 1
-        del bundle
+        for x in queue:
+            ret[i : i + len(x)] = x
+            i += len(x)
+        queue.clear()
         gc.collect()
         return ret
 
-    def socket_disconnect(self) -> None:
+    def socket_disconnect(self, link_id: int = 0) -> None:
         """Close any open socket, if there is one"""
+        self._run(self._socket_disconnect_steps(link_id))
+
+    def _socket_disconnect_steps(self, link_id: int) -> Iterator:
         self._conntype = None
+        self._link_types.pop(link_id, None)
+        if self._unpark(link_id):
+            self.release_link(link_id)  # the pool's, and nobody else will
         try:
-            self.at_response("AT+CIPCLOSE", retries=1)
+            if self._multi_link:
+                yield from self._at_response_steps("AT+CIPCLOSE=%d" % link_id, retries=1)
+            else:
+                yield from self._at_response_steps("AT+CIPCLOSE", retries=1)
         except OKError:
             pass  # this is ok, means we didn't have an open socket
+        # data that raced the close isn't for the link's next connection
+        self._drop_received(link_id)
+
+    def _drop_received(self, link_id: int) -> None:
+        """Forget everything a link received and whether it was closed"""
+        self._rx_queues.pop(link_id, None)
+        self._rx_sources.pop(link_id, None)
+        self._rx_notified.discard(link_id)
+        self._rx_closed.discard(link_id)
+
+    def passthrough(self, timeout: float = 1) -> Passthrough:
+        """Use the open connection in transparent mode, for bulk transfers:
+
+            with esp.passthrough() as pipe:
+                pipe.write(request)
+                got = pipe.readinto(buffer)
+
+        Only available in single link mode, see Passthrough"""
+        return Passthrough(self, timeout)
 
     # *************************** SNTP SETUP ****************************
 
@@ -434,6 +1740,9 @@ class ESP_ATcontrol:
     ) -> None:
         """Configure the built in ESP SNTP client with a UTC-offset number (timezone)
         and server as IP or hostname."""
+        self.at_response(self._sntp_command(enable, timezone, server), timeout=3)
+
+    def _sntp_command(self, enable: bool, timezone: Optional[int], server: Optional[str]) -> str:
         cmd = "AT+CIPSNTPCFG="
         if enable:
             cmd += "1"
@@ -443,7 +1752,7 @@ class ESP_ATcontrol:
             cmd += ",%d" % timezone
         if server is not None:
             cmd += ',"%s"' % server
-        self.at_response(cmd, timeout=3)
+        return cmd
 
     @property
     def sntp_time(self) -> Union[bytes, None]:
@@ -460,13 +1769,19 @@ class ESP_ATcontrol:
     @property
     def is_connected(self) -> bool:
         """Initialize module if not done yet, and check if we're connected to
-        an access point, returns True or False"""
+        an access point, returns True or False. This is a single status query
+        unless the module looks to have reset or lost sync, then we resync first"""
         if not self._initialized:
             self.begin()
         try:
-            self.echo(False)
-            self.baudrate = self.baudrate
-            stat = self.status
+            self._flush_input()  # notice a "ready" from a reset we haven't seen yet
+            if self._needs_resync:
+                self.resync()
+            try:
+                stat = self.status
+            except OKError:
+                self.resync()
+                stat = self.get_status(force=True)
             if stat in {
                 self.STATUS_APCONNECTED,
                 self.STATUS_SOCKETOPEN,
@@ -484,90 +1799,129 @@ class ESP_ATcontrol:
     @property
     def status(self) -> Union[int, None]:
         """The IP connection status number (see AT+CIPSTATUS datasheet for meaning)"""
-        if self._use_cipstatus:
-            replies = self.at_response("AT+CIPSTATUS", timeout=5).split(b"\r\n")
-            for reply in replies:
-                if reply.startswith(b"STATUS:"):
-                    if self._debug:
-                        print(f"CIPSTATUS state is {int(reply[7:8])}")
-                    return int(reply[7:8])
-        else:
-            status_w = self.status_wifi
-            status_s = self.status_socket
+        return self.get_status()
+
+    def get_status(self, force: bool = False) -> Union[int, None]:
+        """The IP connection status number, from the cache if it's still fresh
+        unless 'force' is set"""
+        return self._run(self._status_steps(force))
+
+    def _status_steps(self, force: bool = False) -> Iterator:
+        if not force and self._status_fresh():
+            return self._status_cache
+        replies = yield from self._at_pipeline_steps(self._status_commands(), timeout=5)
+        return self._cache_status(self._status_from(replies))
+
+    def _status_fresh(self) -> bool:
+        return (
+            self._status_stamp is not None
+            and (time.monotonic() - self._status_stamp) < self._status_ttl
+        )
+
+    def _cache_status(self, status: Union[int, None]) -> Union[int, None]:
+        self._status_cache = status
+        self._status_stamp = time.monotonic()
+        return status
+
+    def _invalidate_status(self) -> None:
+        self._status_stamp = None
 
+    def _status_commands(self) -> List[str]:
+        """The queries status needs, to be sent in one pipeline"""
+        if self._use_cipstatus:
+            return ["AT+CIPSTATUS"]
+        if self._debug:
             # debug only, Check CIPSTATUS messages against CWSTATE/CIPSTATE
-            if self._debug:
-                replies = self.at_response("AT+CIPSTATUS", timeout=5).split(b"\r\n")
-                for reply in replies:
-                    if reply.startswith(b"STATUS:"):
-                        cipstatus = int(reply[7:8])
-                print(f"STATUS: CWSTATE: {status_w}, CIPSTATUS: {cipstatus}, CIPSTATE: {status_s}")
-
-            # Produce a cipstatus-compatible status code
-            # Codes are not the same between CWSTATE/CIPSTATUS so in some combinations
-            # we just pick what we hope is best.
-            if status_w in {
-                self.STATUS_WIFI_NOTCONNECTED,
-                self.STATUS_WIFI_DISCONNECTED,
-            }:
-                if self._debug:
-                    print(f"STATUS returning {self.STATUS_NOTCONNECTED}")
-                return self.STATUS_NOTCONNECTED
+            return ["AT+CWSTATE?", "AT+CIPSTATE?", "AT+CIPSTATUS"]
+        return ["AT+CWSTATE?", "AT+CIPSTATE?"]
 
-            if status_s == self.STATUS_SOCKET_OPEN:
-                if self._debug:
-                    print(f"STATUS returning {self.STATUS_SOCKETOPEN}")
-                return self.STATUS_SOCKETOPEN
+    def _status_from(self, replies: List[bytes]) -> Union[int, None]:
+        """The status code from the replies to _status_commands()"""
+        if self._use_cipstatus:
+            return self._parse_cipstatus(replies[0])
+        status_w = self._parse_cwstate(replies[0])
+        status_s = self._parse_cipstate(replies[1])
+        if self._debug:
+            cipstatus = self._parse_cipstatus(replies[2])
+            print(f"STATUS: CWSTATE: {status_w}, CIPSTATUS: {cipstatus}, CIPSTATE: {status_s}")
+        return self._combine_status(status_w, status_s)
 
-            if status_w == self.STATUS_WIFI_APCONNECTED:
+    def _parse_cipstatus(self, reply: bytes) -> Union[int, None]:
+        for line in reply.split(b"\r\n"):
+            if line.startswith(b"STATUS:"):
                 if self._debug:
-                    print(f"STATUS returning {self.STATUS_APCONNECTED}")
-                return self.STATUS_APCONNECTED
+                    print(f"CIPSTATUS state is {int(line[7:8])}")
+                return int(line[7:8])
+        return None
 
-            # handle extra codes from CWSTATE
-            if status_w == 0:  # station has not started any Wi-Fi connection.
-                if self._debug:
-                    print("STATUS returning 1")
-                return 1  # this cipstatus had no previous handler variable
+    def _combine_status(self, status_w: Union[int, None], status_s: int) -> Union[int, None]:
+        """Produce a cipstatus-compatible status code from CWSTATE and CIPSTATE"""
+        # Codes are not the same between CWSTATE/CIPSTATUS so in some combinations
+        # we just pick what we hope is best.
+        if status_w in {
+            self.STATUS_WIFI_NOTCONNECTED,
+            self.STATUS_WIFI_DISCONNECTED,
+        }:
+            if self._debug:
+                print(f"STATUS returning {self.STATUS_NOTCONNECTED}")
+            return self.STATUS_NOTCONNECTED
 
-            if (
-                status_w == 1
-            ):  # station has connected to an AP, but does not get an IPv4 address yet.
-                if self._debug:
-                    print("STATUS returning 1")
-                return 1  # this cipstatus had no previous handler variable
+        if status_s == self.STATUS_SOCKET_OPEN:
+            if self._debug:
+                print(f"STATUS returning {self.STATUS_SOCKETOPEN}")
+            return self.STATUS_SOCKETOPEN
 
-            if status_w == 3:  # station is in Wi-Fi connecting or reconnecting state.
-                if self._debug:
-                    print(f"STATUS returning {self.STATUS_NOTCONNECTED}")
-                return self.STATUS_NOTCONNECTED
+        if status_w == self.STATUS_WIFI_APCONNECTED:
+            if self._debug:
+                print(f"STATUS returning {self.STATUS_APCONNECTED}")
+            return self.STATUS_APCONNECTED
 
-            if status_s == self.STATUS_SOCKET_CLOSED:
-                if self._debug:
-                    print(f"STATUS returning {self.STATUS_SOCKET_CLOSED}")
-                return self.STATUS_SOCKET_CLOSED
+        # handle extra codes from CWSTATE
+        if status_w == 0:  # station has not started any Wi-Fi connection.
+            if self._debug:
+                print("STATUS returning 1")
+            return 1  # this cipstatus had no previous handler variable
+
+        if status_w == 1:  # station has connected to an AP, but does not get an IPv4 address yet.
+            if self._debug:
+                print("STATUS returning 1")
+            return 1  # this cipstatus had no previous handler variable
+
+        if status_w == 3:  # station is in Wi-Fi connecting or reconnecting state.
+            if self._debug:
+                print(f"STATUS returning {self.STATUS_NOTCONNECTED}")
+            return self.STATUS_NOTCONNECTED
+
+        if status_s == self.STATUS_SOCKET_CLOSED:
+            if self._debug:
+                print(f"STATUS returning {self.STATUS_SOCKET_CLOSED}")
+            return self.STATUS_SOCKET_CLOSED
 
         return None
 
     @property
     def status_wifi(self) -> Union[int, None]:
         """The WIFI connection status number (see AT+CWSTATE datasheet for meaning)"""
-        replies = self.at_response("AT+CWSTATE?", timeout=5).split(b"\r\n")
-        for reply in replies:
-            if reply.startswith(b"+CWSTATE:"):
-                state_info = reply.split(b",")
+        return self._parse_cwstate(self.at_response("AT+CWSTATE?", timeout=5))
+
+    def _parse_cwstate(self, reply: bytes) -> Union[int, None]:
+        for line in reply.split(b"\r\n"):
+            if line.startswith(b"+CWSTATE:"):
+                state_info = line.split(b",")
                 if self._debug:
-                    print(f"State reply is {reply}, state_info[1] is {int(state_info[0][9:10])}")
+                    print(f"State reply is {line}, state_info[1] is {int(state_info[0][9:10])}")
                 return int(state_info[0][9:10])
         return None
 
     @property
     def status_socket(self) -> Union[int, None]:
         """The Socket connection status number (see AT+CIPSTATE for meaning)"""
-        replies = self.at_response("AT+CIPSTATE?", timeout=5).split(b"\r\n")
-        for reply in replies:
+        return self._parse_cipstate(self.at_response("AT+CIPSTATE?", timeout=5))
+
+    def _parse_cipstate(self, reply: bytes) -> int:
+        for line in reply.split(b"\r\n"):
             # If there are any +CIPSTATE lines that means it's an open socket
-            if reply.startswith(b"+CIPSTATE:"):
+            if line.startswith(b"+CIPSTATE:"):
                 return self.STATUS_SOCKET_OPEN
         return self.STATUS_SOCKET_CLOSED
 
@@ -576,10 +1930,12 @@ class ESP_ATcontrol:
         """What mode we're in, can be MODE_STATION, MODE_SOFTAP or MODE_SOFTAPSTATION"""
         if not self._initialized:
             self.begin()
-        replies = self.at_response("AT+CWMODE?", timeout=5).split(b"\r\n")
-        for reply in replies:
-            if reply.startswith(b"+CWMODE:"):
-                return int(reply[8:])
+        return self._parse_cwmode(self.at_response("AT+CWMODE?", timeout=5))
+
+    def _parse_cwmode(self, reply: bytes) -> int:
+        for line in reply.split(b"\r\n"):
+            if line.startswith(b"+CWMODE:"):
+                return int(line[8:])
         raise RuntimeError("Bad response to CWMODE?")
 
     @mode.setter
@@ -604,7 +1960,10 @@ class ESP_ATcontrol:
     @property
     def local_ip(self) -> Union[str, None]:
         """Our local IP address as a dotted-quad string"""
-        reply = self.at_response("AT+CIFSR").strip(b"\r\n")
+        return self._parse_cifsr(self.at_response("AT+CIFSR"))
+
+    def _parse_cifsr(self, reply: bytes) -> str:
+        reply = reply.strip(b"\r\n")
         for line in reply.split(b"\r\n"):
             if line and line.startswith(b'+CIFSR:STAIP,"'):
                 return str(line[14:-1], "utf-8")
@@ -624,8 +1983,31 @@ class ESP_ATcontrol:
         raise RuntimeError("Couldn't ping")
 
     def nslookup(self, host: str) -> Union[str, None]:
-        """Return a dotted-quad IP address strings that matches the hostname"""
-        reply = self.at_response('AT+CIPDOMAIN="%s"' % host.strip('"'), timeout=3)
+        """Return a dotted-quad IP address strings that matches the hostname,
+        from the dns_cache if it's there"""
+        return self._run(self._nslookup_steps(host))
+
+    def _nslookup_steps(self, host: str) -> Iterator:
+        host = host.strip('"')
+        ipaddr = self._dns_cache.get(host)
+        if ipaddr:
+            return ipaddr
+        try:
+            reply = yield from self._at_response_steps('AT+CIPDOMAIN="%s"' % host, timeout=3)
+            ipaddr = self._parse_cipdomain(reply)
+        except (OKError, RuntimeError) as error:
+            self._dns_cache.put(host, error)
+            raise
+        self._dns_cache.put(host, ipaddr)
+        return ipaddr
+
+    @property
+    def dns_cache(self) -> DNSCache:
+        """The DNSCache nslookup() answers from, to flush() it or check its
+        hits and misses"""
+        return self._dns_cache
+
+    def _parse_cipdomain(self, reply: bytes) -> str:
         for line in reply.split(b"\r\n"):
             if line and line.startswith(b"+CIPDOMAIN:"):
                 return str(line[11:], "utf-8").strip('"')
@@ -636,12 +2018,25 @@ class ESP_ATcontrol:
     @property
     def remote_AP(self) -> List[Union[int, str, None]]:
         """The name of the access point we're connected to, as a string"""
-        stat = self.status
+        return self._run(self._remote_ap_steps())
+
+    def _remote_ap_steps(self) -> Iterator:
+        if self._status_fresh():
+            if self._status_cache != self.STATUS_APCONNECTED:
+                return [None] * 4
+            reply = yield from self._at_response_steps("AT+CWJAP?", timeout=10)
+            return self._parse_cwjap(reply)
+        # ask for the AP along with the status, it's ignored if we're not connected
+        commands = self._status_commands() + ["AT+CWJAP?"]
+        replies = yield from self._at_pipeline_steps(commands, timeout=10)
+        stat = self._cache_status(self._status_from(replies[:-1]))
         if stat != self.STATUS_APCONNECTED:
             return [None] * 4
-        replies = self.at_response("AT+CWJAP?", timeout=10).split(b"\r\n")
-        for reply in replies:
-            if not reply.startswith("+CWJAP:"):
+        return self._parse_cwjap(replies[-1])
+
+    def _parse_cwjap(self, response: bytes) -> List[Union[int, str, None]]:
+        for reply in response.split(b"\r\n"):
+            if not reply.startswith(b"+CWJAP:"):
                 continue
             reply = reply[7:].split(b",")
             for i, val in enumerate(reply):
@@ -656,16 +2051,22 @@ class ESP_ATcontrol:
     def join_AP(self, ssid: str, password: str, timeout: int = 15, retries: int = 3) -> None:
         """Try to join an access point by name and password, will return
         immediately if we're already connected and won't try to reconnect"""
+        if not self._initialized:
+            self.begin()
+        self._run(self._join_ap_steps(ssid, password, timeout, retries))
+
+    def _join_ap_steps(self, ssid: str, password: str, timeout: int, retries: int) -> Iterator:
         # First make sure we're in 'station' mode so we can connect to AP's
         if self._debug:
             print("In join_AP()")
-        if self.mode != self.MODE_STATION:
-            self.mode = self.MODE_STATION
+        reply = yield from self._at_response_steps("AT+CWMODE?", timeout=5)
+        if self._parse_cwmode(reply) != self.MODE_STATION:
+            yield from self._at_response_steps("AT+CWMODE=%d" % self.MODE_STATION, timeout=3)
 
-        router = self.remote_AP
+        router = yield from self._remote_ap_steps()
         if router and router[0] == ssid:
             return  # we're already connected!
-        reply = self.at_response(
+        reply = yield from self._at_response_steps(
             'AT+CWJAP="' + ssid + '","' + password + '"',
             timeout=timeout,
             retries=retries,
@@ -676,7 +2077,6 @@ class ESP_ATcontrol:
         if b"WIFI GOT IP" not in reply:
             print("no IP")
             raise RuntimeError("Didn't get IP address")
-        return
 
     def join_AP_Enterprise(
         self,
@@ -750,16 +2150,8 @@ class ESP_ATcontrol:
                 if self._debug is True:
                     print(f"disconnect(): Got WIFI DISCONNECT: {reply}")
             else:
-                stamp = time.monotonic()
-                response = b""
-                while (time.monotonic() - stamp) < timeout:
-                    if self._uart.in_waiting:
-                        response += self._uart.read(1)
-                        self.hw_flow(False)
-                        if response[-15:] == b"WIFI DISCONNECT":
-                            break
-                    else:
-                        self.hw_flow(True)
+                response = self._reader.read_until(_Matcher((b"WIFI DISCONNECT",)), timeout)
+                self._dispatch_urcs(response)
                 if self._debug:
                     if response[-15:] == b"WIFI DISCONNECT":
                         print(f"disconnect(): Got WIFI DISCONNECT: {response}")
@@ -799,7 +2191,10 @@ class ESP_ATcontrol:
     def get_version(self) -> Union[str, None]:
         """Request the AT firmware version string and parse out the
         version number"""
-        reply = self.at_response("AT+GMR", timeout=3).strip(b"\r\n")
+        return self._parse_gmr(self.at_response("AT+GMR", timeout=3))
+
+    def _parse_gmr(self, reply: bytes) -> Union[str, None]:
+        reply = reply.strip(b"\r\n")
         self._version = None
         for line in reply.split(b"\r\n"):
             if line:
@@ -814,59 +2209,360 @@ class ESP_ATcontrol:
         if self._rts_pin:
             self._rts_pin.value = not flag
 
-    def at_response(self, at_cmd: str, timeout: int = 5, retries: int = 3) -> bytes:
+    def at_response(self, at_cmd: str, timeout: int = 5, retries: Optional[int] = None) -> bytes:
         """Send an AT command, check that we got an OK response,
         and then cut out the reply lines to return. We can set
         a variable timeout (how long we'll wait for response) and
-        how many times to retry before giving up"""
-        for _ in range(retries):
-            self.hw_flow(True)  # allow any remaning data to stream in
-            time.sleep(0.1)  # wait for uart data
-            self._uart.reset_input_buffer()  # flush it
-            self.hw_flow(False)  # and shut off flow control again
+        how many times to try before giving up, by default as many
+        as the command's retry policy allows"""
+        return self._run(self._at_response_steps(at_cmd, timeout, retries))
+
+    def _at_response_steps(
+        self, at_cmd: str, timeout: int = 5, retries: Optional[int] = None
+    ) -> Iterator:
+        rule = self.response_rule(at_cmd)
+        retry = self.retry_policy(at_cmd).start(at_cmd, retries)
+        silent = False
+        while True:
+            yield from self._send_command_steps(at_cmd)
+            matcher = rule.matcher()
+            response = yield from self._read_steps(matcher, timeout)
+            reply = self._check_reply(rule, matcher, response)
+            if reply is not None:
+                if retry.failures:
+                    retry.done()
+                self._desyncs = 0
+                return reply
+            if matcher.end < 0:
+                # not even an ERROR back, we may have lost sync with the module
+                self._needs_resync = True
+                silent = True
+            wait = retry.next_delay()
+            if wait is None:
+                if silent:
+                    self._desyncs += 1  # once per command, however often it was tried
+                raise OKError("No OK response to " + at_cmd)
+            yield wait
+
+    def at_pipeline(
+        self,
+        commands: List[str],
+        timeout: int = 5,
+        retries: Optional[int] = None,
+        strict: bool = True,
+    ) -> List[Union[bytes, None]]:
+        """Send several AT commands back-to-back and split the replies apart by
+        their terminators, so they cost about one round trip instead of one each.
+        Returns each reply as at_response() would. A command the module answers
+        with ERROR raises OKError, or gives None if 'strict' is False. Commands
+        the module turned away with "busy p..." while it ran an earlier one are
+        sent again one at a time through at_response() with 'retries', and so
+        is the rest if a reply went missing"""
+        return self._run(self._at_pipeline_steps(commands, timeout, retries, strict))
+
+    def _at_pipeline_steps(
+        self,
+        commands: List[str],
+        timeout: int = 5,
+        retries: Optional[int] = None,
+        strict: bool = True,
+    ) -> Iterator:
+        yield from self._send_command_steps("\r\n".join(commands))
+        replies = [None] * len(commands)
+        again = []  # indexes of the commands to send again one at a time
+        index = 0
+        while index < len(commands):
+            at_cmd = commands[index]
+            later = len(commands) - index - 1
+            rule = self.response_rule(at_cmd)
+            response, matcher, busy = yield from self._read_pipelined_steps(rule, timeout, later)
+            if busy > later:
+                again.extend(range(index, len(commands)))  # this one was turned away too
+                break
+            reply = self._check_reply(rule, matcher, response)
+            if reply is None:
+                if response[-7:] != b"ERROR\r\n":
+                    # out of step with the module, finish one at a time
+                    again.extend(range(index, len(commands)))
+                    break
+                if strict:
+                    raise OKError("No OK response to " + at_cmd)
+            replies[index] = reply
+            # each busy line turned away the next command while this one ran
+            again.extend(range(index + 1, index + 1 + busy))
+            index += 1 + busy
+        for index in again:
+            try:
+                replies[index] = yield from self._at_response_steps(
+                    commands[index], timeout, retries
+                )
+            except OKError:
+                if strict:
+                    raise
+        return replies
+
+    def _read_pipelined_steps(self, rule: ResponseRule, timeout: float, later: int) -> Iterator:
+        """Read the reply to a pipelined command with 'later' commands sent after
+        it. Busy lines for those are cut out of the reply and counted. Returns the
+        reply, a matcher run over it and the count, which is more than 'later' if
+        this command was turned away as well"""
+        response = b""
+        busy = 0
+        stamp = time.monotonic()
+        while True:
+            matcher = _Matcher(rule.terminators + (_BUSY_LINE,))
+            left = timeout - (time.monotonic() - stamp)
+            part = yield from self._read_steps(matcher, max(0, left))
+            if not part.endswith(_BUSY_LINE):
+                response += part
+                break
+            response += part[: -len(_BUSY_LINE)]
+            busy += 1
+            if busy > later:
+                break
+        matcher = rule.matcher()
+        matcher.search(response)
+        return response, matcher, busy
+
+    @staticmethod
+    def _run(steps: Iterator) -> Any:
+        """Run the steps of an operation, one of the _*_steps() generators, to
+        the end and return its result. Each step yields None to be called again
+        right away, _IDLE while it's only waiting for data, or seconds to sleep.
+        AsyncESP_ATcontrol runs the same steps, awaiting between them instead"""
+        try:
+            while True:
+                wait = next(steps)
+                if wait and wait > 0:
+                    time.sleep(wait)
+        except StopIteration as done:
+            return done.value
+
+    def _read_steps(self, matcher: _Matcher, timeout: float, divert: bool = True) -> Iterator:
+        """The reader's read_until() as steps, diverted frames included"""
+        response = bytearray()
+        stamp = time.monotonic()
+        while (time.monotonic() - stamp) < timeout:
+            step = self._reader.read_step(matcher, response, timeout, divert)
+            if step is True:
+                break
+            if step:
+                yield from step
+            else:
+                yield
+        return bytes(response)
+
+    def _send_command_steps(self, at_cmd: str) -> Iterator:
+        if self._sending is not None:
+            yield from self._await_send_steps()  # or the module just says busy
+        for prefix in self.STATUS_COMMANDS:
+            if prefix in at_cmd:
+                self._invalidate_status()
+                break
+        for prefix in self.AP_COMMANDS:
+            if prefix in at_cmd:
+                self._dns_cache.flush()
+                break
+        self.hw_flow(True)  # allow any remaning data to stream in
+        yield from self._flush_input_steps()
+        self.hw_flow(False)  # and shut off flow control again
+        if self._debug:
+            print("--->", at_cmd)
+        self._uart.write(bytes(at_cmd, "utf-8"))
+        self._uart.write(b"\x0d\x0a")
+
+    def _check_reply(
+        self, rule: ResponseRule, matcher: _Matcher, response: bytes
+    ) -> Union[bytes, None]:
+        """The reply to hand back for a finished response, or None to retry"""
+        if self._debug:
+            print("<---", response)
+        self._dispatch_urcs(response)
+        # some commands finish without an OK, see RESPONSE_RULES
+        if matcher.seen(rule.accept):
+            return response
+        if matcher.seen(rule.busy) or response[-4:] != b"OK\r\n":
+            return None
+        return response[:-4]
+
+    def _flush_input(self) -> None:
+        self._run(self._flush_input_steps())
+
+    def _flush_input_steps(self) -> Iterator:
+        """Handle pending input before a command, waiting only while the line is busy"""
+        if self._quiet_chars is None:
+            yield 0.1  # wait for uart data
+            self._reader.reset_input_buffer()  # flush it
+            return
+        # 10 bits per character: start, 8 data and stop
+        idle = self._quiet_chars * 10 / self._uart.baudrate
+        stamp = quiet = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if self._reader.in_waiting:
+                # a whole line or +IPD frame, however long the payload takes
+                yield from self._poll_input_steps(0.1)
+                quiet = time.monotonic()
+            elif now - quiet >= idle:
+                return
+            else:
+                yield
+            if now - stamp >= 0.1:
+                return  # never quiet, the reply is read with any URCs in it
+
+    # ************************** UNSOLICITED RESULTS ****************************
+
+    def add_urc_callback(self, urc: bytes, callback) -> None:
+        """Call callback(urc, link_id) whenever the module sends the unsolicited
+        result 'urc' (one of URCS, or b"+IPD" for received data), whichever
+        read happens to see it"""
+        self._urc_callbacks.setdefault(urc, []).append(callback)
+
+    def remove_urc_callback(self, urc: bytes, callback) -> None:
+        """Stop calling a callback added with add_urc_callback()"""
+        self._urc_callbacks.get(urc, []).remove(callback)
+
+    def _urc(self, urc: bytes, link_id: int) -> None:
+        if urc == b"CONNECT":
+            self._cache_status(self.STATUS_SOCKETOPEN)
+            self._rx_closed.discard(link_id)
+        elif urc in {b"SEND OK", b"SEND FAIL"}:
+            # the module only sends one thing at a time, so it's for _sending
+            if urc == b"SEND FAIL" and self._sending is not None:
+                self._send_failed.add(self._sending)
+                self._invalidate_status()
+            self._sending = None
+        elif urc != b"+IPD":
+            self._invalidate_status()
+        if urc == b"CLOSED":
+            self._rx_closed.add(link_id)
+        if urc == b"WIFI DISCONNECT":  # the next AP may resolve names differently
+            self._dns_cache.flush()
+        if urc == b"ready":  # the module restarted on its own
+            self._needs_resync = True
+            self._forget_links()
+        for callback in self._urc_callbacks.get(urc, ()):
+            callback(urc, link_id)
+
+    def _dispatch_urcs(self, response: bytes) -> None:
+        """Hand any unsolicited result lines in 'response' to their callbacks"""
+        for line in response.split(b"\r\n"):
+            link_id = 0
+            if line[1:2] == b"," and 48 <= line[0] <= 57:  # "<link ID>,CLOSED"
+                link_id = line[0] - 48
+                line = line[2:]
+            if line in self.URCS:
+                self._urc(line, link_id)
+
+    def _poll_input_steps(self, timeout: float) -> Iterator:
+        """Handle one line or +IPD frame of input nobody asked for"""
+        matcher = _Matcher((b"\r\n", b"+IPD,"))
+        line = yield from self._read_steps(matcher, timeout, divert=False)
+        if line[-5:] == b"+IPD,":
+            yield from self._receive_ipd_steps(timeout)
+        else:
+            self._dispatch_urcs(line)
+
+    def _receive_ipd_steps(self, timeout: float) -> Iterator:
+        """Move one +IPD frame, whose prefix was already read, to its link's queue"""
+        header = self._ipd_header
+        header.reset()
+        stamp = time.monotonic()
+        while not self._reader.parse(header) and (time.monotonic() - stamp) < timeout:
+            yield
+        if not header.done:
+            # leave whatever broke it to be read as the next line
             if self._debug:
-                print("--->", at_cmd)
-            self._uart.write(bytes(at_cmd, "utf-8"))
-            self._uart.write(b"\x0d\x0a")
-            stamp = time.monotonic()
-            response = b""
-            while (time.monotonic() - stamp) < timeout:
-                if self._uart.in_waiting:
-                    response += self._uart.read(1)
-                    self.hw_flow(False)
-                    if response[-4:] == b"OK\r\n":
-                        break
-                    if response[-7:] == b"ERROR\r\n":
-                        break
-                    if "AT+CWJAP=" in at_cmd or "AT+CWJEAP=" in at_cmd:
-                        if b"WIFI GOT IP\r\n" in response:
-                            break
-                    elif b"WIFI CONNECTED\r\n" in response:
-                        break
-                    if b"ERR CODE:" in response:
-                        break
-                else:
-                    self.hw_flow(True)
-            # eat beginning \n and \r
+                print("Bad +IPD header", header.fields)
+            return
+        link_id, length = header.link_id, header.length
+        if header.notice:
+            # passive receive mode, the data waits on the module for AT+CIPRECVDATA
+            self._rx_notified.add(link_id)
+            self._urc(b"+IPD", link_id)
+            return
+        if self._debug:
+            print("Receiving:", length)
+        target = self._rx_into
+        if target and target[0] == link_id and not self._rx_queues.get(link_id):
+            # someone is waiting in socket_receive_into(), fill their buffer first
+            view = target[1][self._rx_into_got :]
+            size = min(length, len(view))
+            got = yield from self._read_payload_steps(view[:size], timeout)
+            self._rx_into_got += got
+            length = length - size if got == size else 0
+        if length:
+            data = bytearray(length)
+            got = yield from self._read_payload_steps(memoryview(data), timeout)
+            self._rx_queues.setdefault(link_id, []).append(data if got == length else data[:got])
+            if link_id in self._rx_sources:
+                self._rx_sources[link_id].append(header.remote)
+        self._urc(b"+IPD", link_id)
+
+    def _read_payload_steps(self, view: memoryview, timeout: float) -> Iterator:
+        """Read into all of 'view' unless nothing arrives for 'timeout' seconds,
+        returns the bytes read"""
+        got = 0
+        stamp = time.monotonic()
+        while got < len(view) and (time.monotonic() - stamp) < timeout:
+            more = self._reader.readinto(view[got:])
+            if more:
+                got += more
+                stamp = time.monotonic()
+            else:
+                yield
+        return got
+
+    def response_rule(self, at_cmd: str) -> ResponseRule:
+        """The rule registered for the longest prefix of 'at_cmd'"""
+        best = ""
+        for prefix in self._response_rules:
+            if len(prefix) > len(best) and at_cmd.startswith(prefix):
+                best = prefix
+        return self._response_rules[best]
+
+    def register_response_rule(self, prefix: str, rule: ResponseRule) -> None:
+        """Use 'rule' to decide when the reply to any AT command starting with
+        'prefix' is complete, for commands that don't end with a plain OK"""
+        self._response_rules[prefix] = rule
+
+    def retry_policy(self, name: str) -> RetryPolicy:
+        """The retry policy for the longest registered prefix of 'name', which
+        is an AT command or one of begin, connect_enterprise or socket_connect"""
+        best = ""
+        for prefix in self._retry_policies:
+            if len(prefix) > len(best) and name.startswith(prefix):
+                best = prefix
+        return self._retry_policies[best]
+
+    def set_retry_policy(self, prefix: str, policy: RetryPolicy) -> None:
+        """Retry AT commands (or the methods named above) starting with 'prefix'
+        according to 'policy', "" sets the default for AT commands"""
+        self._retry_policies[prefix] = policy
+
+    def resync(self) -> None:
+        """Turn echo back off and re-send our baudrate, for when the module
+        may have reset or we lost sync with it. With a negotiated baudrate
+        that keeps failing, we drop to the next slower candidate first"""
+        if self._negotiate_baudrate and self._desyncs >= self.DESYNC_LIMIT:
+            slower = [rate for rate in self.BAUDRATE_CANDIDATES if rate < self.baudrate]
+            baudrate = slower[-1] if slower else self._default_baudrate
             if self._debug:
-                print("<---", response)
-            # special case, AT+CWJAP= does not return an ok :P
-            if "AT+CWJAP=" in at_cmd and b"WIFI GOT IP\r\n" in response:
-                return response
-            # special case, AT+CWJEAP= does not return an ok :P
-            if "AT+CWJEAP=" in at_cmd and b"WIFI GOT IP\r\n" in response:
-                return response
-            if "AT+CWQAP=" in at_cmd and b"WIFI DISCONNECT" in response:
-                return response
-            # special case, ping also does not return an OK
-            if "AT+PING" in at_cmd and b"ERROR\r\n" in response:
-                return response
-            # special case, does return OK but in fact it is busy
-            if "AT+CIFSR" in at_cmd and b"busy" in response or response[-4:] != b"OK\r\n":
-                time.sleep(1)
-                continue
-            return response[:-4]
-        raise OKError("No OK response to " + at_cmd)
+                print("Lost sync too often, dropping to baudrate", baudrate)
+            self._recover_baudrate(baudrate)
+            self._run_baudrate = baudrate
+            self._desyncs = 0
+            self._save_capabilities()
+        self.echo(False)
+        self.baudrate = self.baudrate
+        try:
+            self.at_response("AT+CIPDINFO=1", timeout=3, retries=1)
+            self._ipd_info = True
+        except OKError:
+            self._ipd_info = False  # old firmware, socket_receive_from() won't know the sender
+        if self._passive_receive:
+            self.at_response("AT+CIPRECVMODE=1", timeout=3)
+        self._needs_resync = False
 
     def sync(self) -> bool:
         """Check if we have AT commmand sync by sending plain ATs"""
@@ -898,10 +2594,55 @@ class ESP_ATcontrol:
         time.sleep(0.25)
         self._uart.baudrate = baudrate
         time.sleep(0.25)
-        self._uart.reset_input_buffer()
+        self._reader.reset_input_buffer()
         if not self.sync():
             raise RuntimeError("Failed to resync after Baudrate change")
 
+    def negotiate_baudrate(self) -> int:
+        """Step up through BAUDRATE_CANDIDATES from the current baudrate, and
+        at each one check that BAUDRATE_TEST_ROUNDS AT+GMR replies come back
+        byte for byte the same as at the starting rate. Stays at the fastest
+        that had no errors, which resync() then goes back to, and returns it"""
+        stable = self.baudrate
+        reference = self.at_response("AT+GMR", timeout=3)
+        for baudrate in self.BAUDRATE_CANDIDATES:
+            if baudrate <= stable:
+                continue
+            try:
+                self.baudrate = baudrate
+                clean = all(
+                    self.at_response("AT+GMR", timeout=1, retries=1) == reference
+                    for _ in range(self.BAUDRATE_TEST_ROUNDS)
+                )
+            except (OKError, RuntimeError, ValueError):
+                clean = False  # ValueError if our UART can't do that baudrate
+            if not clean:
+                if self._debug:
+                    print("Baudrate", baudrate, "failed, staying at", stable)
+                self._recover_baudrate(stable)
+                break
+            stable = baudrate
+        self._run_baudrate = stable
+        self._desyncs = 0
+        self._needs_resync = False
+        return stable
+
+    def _recover_baudrate(self, baudrate: int) -> None:
+        """Find the baudrate the module listens at, which may be the one we're
+        set to, 'baudrate' or its default, and then move both ends to 'baudrate'.
+        If it answers at none of them, hard reset it"""
+        for rate in (self._uart.baudrate, baudrate, self._default_baudrate):
+            self._uart.baudrate = rate
+            self._reader.reset_input_buffer()
+            if self.sync():
+                break
+        else:
+            self.hard_reset()  # back to the default baudrate
+            if not self.sync():
+                raise RuntimeError("Lost sync with the module")
+        if self._uart.baudrate != baudrate:
+            self.baudrate = baudrate
+
     def echo(self, echo: bool) -> None:
         """Set AT command echo on or off"""
         if echo:
@@ -913,26 +2654,18 @@ class ESP_ATcontrol:
         """Perform a software reset by AT command. Returns True
         if we successfully performed, false if failed to reset"""
         try:
-            self._uart.reset_input_buffer()
+            self._reader.reset_input_buffer()
             reply = self.at_response("AT+RST", timeout=1)
             if self._debug:
                 print(f"Resetting with AT+RST, reply was {reply}")
-            stamp = time.monotonic()
-            response = b""
-            while (time.monotonic() - stamp) < timeout:
-                if self._uart.in_waiting:
-                    response += self._uart.read(1)
-                    self.hw_flow(False)
-                    if response[-5:] == b"ready":
-                        break
-                else:
-                    self.hw_flow(True)
+            response = self._reader.read_until(_Matcher((b"ready",)), timeout)
             if self._debug:
                 if response[-5:] == b"ready":
                     print(f"soft_reset(): Got ready: {response}")
                 else:
                     print(f"soft_reset(): imed out waiting for ready: {response}")
-            self._uart.reset_input_buffer()
+            self._reader.reset_input_buffer()
+            self._forget_links()
             self.sync()
             return True
         except OKError:
@@ -955,7 +2688,10 @@ class ESP_ATcontrol:
             self._reset_pin.value = True
             self._uart.baudrate = self._default_baudrate
             time.sleep(3)  # give it a few seconds to wake up
-            self._uart.reset_input_buffer()
+            self._reader.reset_input_buffer()
+            self._invalidate_status()
+            self._sending = None
+            self._forget_links()
             self._initialized = False
 
     def deep_sleep(self, duration_ms: int) -> bool:
@@ -0,0 +1,189 @@
+# SPDX-FileCopyrightText: 2026 Adafruit Industries
+#
+# SPDX-License-Identifier: MIT
+
+"""
+`adafruit_espatcontrol.adafruit_espatcontrol_async`
+====================================================
+
+asyncio flavour of the ESP AT command driver. The commands that spend their
+time waiting on the module are coroutines, so other tasks (sensor sampling,
+display updates) keep running while a slow AT+CIPSTART or AT+CWJAP is in flight.
+
+**Software and Dependencies:**
+
+* Adafruit CircuitPython firmware for the supported boards:
+  https://github.com/adafruit/circuitpython/releases
+
+* Adafruit's asyncio library: https://github.com/adafruit/Adafruit_CircuitPython_asyncio
+
+"""
+
+import asyncio
+
+from adafruit_espatcontrol.adafruit_espatcontrol import _IDLE, ESP_ATcontrol, OKError
+
+try:
+    from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+    from circuitpython_typing import ReadableBuffer, WriteableBuffer
+except ImportError:
+    pass
+
+
+class AsyncESP_ATcontrol:
+    """Awaitable versions of the ESP_ATcontrol commands that wait on the module.
+    Wraps an ESP_ATcontrol, which is still used for setup (begin, resets,
+    baudrate) and anything else that is quick. Each command runs the same steps
+    as its ESP_ATcontrol counterpart, awaiting wherever that one would block.
+    Commands from different tasks are serialized, so they never interleave on
+    the UART, but a task that is only waiting for data lets the others go first."""
+
+    def __init__(self, esp: ESP_ATcontrol) -> None:
+        self.esp = esp
+        self._lock = asyncio.Lock()
+
+    async def _run(self, steps: Iterator) -> Any:
+        """Run the steps of an ESP_ATcontrol operation to the end and return
+        its result, see ESP_ATcontrol._run(). The lock is held throughout,
+        except while the steps idle waiting for data"""
+        lock = self._lock
+        held = False
+        try:
+            await lock.acquire()
+            held = True
+            while True:
+                try:
+                    wait = next(steps)
+                except StopIteration as done:
+                    return done.value
+                if wait == _IDLE:
+                    lock.release()
+                    held = False
+                    await asyncio.sleep(0)
+                    await lock.acquire()
+                    held = True
+                else:
+                    await asyncio.sleep(wait or 0)
+        finally:
+            if held:
+                lock.release()
+            steps.close()  # if we were cancelled, let it clean up
+
+    async def at_response(
+        self, at_cmd: str, timeout: int = 5, retries: Optional[int] = None
+    ) -> bytes:
+        """Send an AT command, check that we got an OK response,
+        and then cut out the reply lines to return"""
+        return await self._run(self.esp._at_response_steps(at_cmd, timeout, retries))
+
+    async def at_pipeline(
+        self,
+        commands: List[str],
+        timeout: int = 5,
+        retries: Optional[int] = None,
+        strict: bool = True,
+    ) -> List[Union[bytes, None]]:
+        """Send several AT commands back-to-back and split the replies apart,
+        see ESP_ATcontrol.at_pipeline()"""
+        return await self._run(self.esp._at_pipeline_steps(commands, timeout, retries, strict))
+
+    async def status(self, force: bool = False) -> Union[int, None]:
+        """The IP connection status number (see AT+CIPSTATUS datasheet for meaning),
+        shares the ESP_ATcontrol status cache unless 'force' is set"""
+        return await self._run(self.esp._status_steps(force))
+
+    # *************************** SOCKETS ****************************
+
+    async def socket_connect(
+        self,
+        conntype: str,
+        remote: str,
+        remote_port: int,
+        *,
+        keepalive: int = 10,
+        retries: Optional[int] = 1,
+        link_id: int = 0,
+    ) -> bool:
+        """Open a socket, see ESP_ATcontrol.socket_connect()"""
+        return await self._run(
+            self.esp._socket_connect_steps(
+                conntype, remote, remote_port, keepalive, retries, link_id
+            )
+        )
+
+    async def socket_send(
+        self,
+        buffer: ReadableBuffer,
+        timeout: int = 1,
+        link_id: int = 0,
+        remote: Optional[Tuple[str, int]] = None,
+    ) -> int:
+        """Send data over the already-opened socket in SEND_CHUNK_SIZE slices,
+        returns how many bytes were sent, see ESP_ATcontrol.socket_send()"""
+        return await self._run(self.esp._socket_send_steps(buffer, timeout, link_id, remote))
+
+    async def socket_receive(self, timeout: int = 5, link_id: int = 0) -> bytearray:
+        """Wait for incoming data over the open socket, returns bytes"""
+        return await self._run(self.esp._socket_receive_steps(timeout, link_id))
+
+    async def socket_receive_into(
+        self, buffer: WriteableBuffer, nbytes: int = 0, timeout: int = 5, link_id: int = 0
+    ) -> int:
+        """Wait for incoming data over the open socket and read it straight
+        into 'buffer', see ESP_ATcontrol.socket_receive_into()"""
+        view = memoryview(buffer)
+        if nbytes:
+            view = view[:nbytes]
+        return await self._run(self.esp._socket_receive_into_steps(view, timeout, link_id))
+
+    async def socket_receive_from(
+        self, buffer: WriteableBuffer, nbytes: int = 0, timeout: int = 5, link_id: int = 0
+    ) -> Tuple[int, Optional[Tuple[str, int]]]:
+        """Wait for one datagram on an open UDP link and put it in 'buffer',
+        see ESP_ATcontrol.socket_receive_from()"""
+        return await self._run(
+            self.esp._socket_receive_from_steps(buffer, nbytes, timeout, link_id)
+        )
+
+    async def allocate_link(self) -> int:
+        """Reserve a free link ID for a new connection, closing the connection
+        parked longest if need be, see ESP_ATcontrol.allocate_link()"""
+        return await self._run(self.esp._allocate_link_steps())
+
+    async def park_link(self, link_id: int, remote: str, remote_port: int) -> bool:
+        """Keep the connection on a link open for reuse instead of closing it,
+        see ESP_ATcontrol.park_link()"""
+        return await self._run(self.esp._park_link_steps(link_id, remote, remote_port))
+
+    async def take_parked_link(
+        self, remote: str, remote_port: int, conntype: Optional[str] = None
+    ) -> Optional[int]:
+        """The link ID of a parked connection to 'remote' that is still open,
+        see ESP_ATcontrol.take_parked_link()"""
+        return await self._run(self.esp._take_parked_link_steps(remote, remote_port, conntype))
+
+    async def socket_disconnect(self, link_id: int = 0) -> None:
+        """Close any open socket, if there is one"""
+        await self._run(self.esp._socket_disconnect_steps(link_id))
+
+    # *************************** WIFI ****************************
+
+    async def nslookup(self, host: str) -> Union[str, None]:
+        """Return a dotted-quad IP address strings that matches the hostname,
+        from the dns_cache if it's there"""
+        return await self._run(self.esp._nslookup_steps(host))
+
+    async def connect(
+        self, secrets: Dict[str, Union[str, int]], timeout: int = 15, retries: int = 3
+    ) -> None:
+        """Try to connect to an access point with the details in the passed in
+        'secrets' dictionary, see ESP_ATcontrol.connect()"""
+        esp = self.esp
+        try:
+            if not esp._initialized:
+                esp.begin()
+            await self._run(esp._connect_steps(secrets, timeout, retries))
+        except (RuntimeError, OKError) as exp:
+            print("Failed to connect\n", exp)
+            raise
@@ -0,0 +1,266 @@
+# SPDX-FileCopyrightText: 2026 Adafruit Industries
+#
+# SPDX-License-Identifier: MIT
+
+"""A 'socket' compatible interface thru the ESP AT command set, for asyncio"""
+
+from micropython import const
+
+from .adafruit_espatcontrol_socket import _RingBuffer
+
+try:
+    from typing import List, Optional, Tuple
+
+    from circuitpython_typing import WriteableBuffer
+
+    from .adafruit_espatcontrol_async import AsyncESP_ATcontrol
+except ImportError:
+    pass
+
+_the_interface = None
+
+
+def set_interface(iface: AsyncESP_ATcontrol) -> None:
+    """Helper to set the global internet interface, used by the module level
+    functions and by sockets not made through a SocketPool"""
+    global _the_interface  # noqa: PLW0603
+    _the_interface = iface
+
+
+SOCK_STREAM = const(1)
+SOCK_DGRAM = const(2)
+AF_INET = const(2)
+
+
+async def getaddrinfo(
+    host: str,
+    port: int,
+    family: int = 0,
+    socktype: int = 0,
+    proto: int = 0,
+    flags: int = 0,
+) -> List[Tuple[int, int, int, str, Tuple[str, int]]]:
+    """Given a hostname and a port name, return a 'socket.getaddrinfo'
+    compatible list of tuples. Honestly, we ignore anything but host & port"""
+    if not isinstance(port, int):
+        raise RuntimeError("port must be an integer")
+    ipaddr = await _the_interface.nslookup(host)
+    return [(AF_INET, socktype, proto, "", (ipaddr, port))]
+
+
+class socket:
+    """A simplified implementation of the Python 'socket' class with awaitable
+    methods, for connecting through an interface to a remote device. Received
+    data is buffered in a ring of 'buffer_size' bytes. It talks to 'interface',
+    or the one given to set_interface() if that's None"""
+
+    def __init__(
+        self,
+        family: int = AF_INET,
+        type: int = SOCK_STREAM,
+        proto: int = 0,
+        fileno: Optional[int] = None,
+        *,
+        buffer_size: int = 2048,
+        interface: Optional[AsyncESP_ATcontrol] = None,
+    ) -> None:
+        if family != AF_INET:
+            raise RuntimeError("Only AF_INET family supported")
+        if type not in {SOCK_STREAM, SOCK_DGRAM}:
+            raise RuntimeError("Only SOCK_STREAM and SOCK_DGRAM types supported")
+        self._interface = interface or _the_interface
+        self._type = type
+        self._remote = None
+        self._ring = _RingBuffer(buffer_size)
+        self._link_id = 0
+        self._owns_link = False
+        self.settimeout(0)
+
+    async def connect(self, address: Tuple[str, int], conntype: Optional[str] = None) -> None:
+        """Connect the socket to the 'address' (which should be dotted quad IP). 'conntype'
+        is an extra that may indicate SSL or not, depending on the underlying interface.
+        A SOCK_DGRAM socket is always UDP. A SOCK_STREAM socket reuses a connection
+        to the same place that the interface's link pool kept open, if there is one
+        """
+        host, port = address
+        if self._type == SOCK_DGRAM:
+            conntype = self._interface.esp.TYPE_UDP
+        else:
+            link_id = await self._interface.take_parked_link(host, port, conntype)
+            if link_id is not None:
+                if self._owns_link and link_id != self._link_id:
+                    self._interface.esp.release_link(self._link_id)
+                self._link_id = link_id
+                self._owns_link = True
+                self._remote = address
+                self._ring.clear()
+                return
+
+        if not self._owns_link:
+            self._link_id = await self._interface.allocate_link()
+            self._owns_link = True
+        connected = await self._interface.socket_connect(
+            conntype, host, port, keepalive=10, retries=None, link_id=self._link_id
+        )
+        if not connected:
+            raise RuntimeError("Failed to connect to host", host)
+        self._remote = address
+        self._ring.clear()
+
+    async def send(self, data: bytes) -> int:
+        """Send some data to the socket, returns how many bytes were sent"""
+        return await self._interface.socket_send(data, link_id=self._link_id)
+
+    async def sendto(self, data: bytes, address: Tuple[str, int]) -> int:
+        """Send a datagram to 'address' (which should be dotted quad IP), returns
+        how many bytes were sent. The first one opens the UDP link, which then
+        stays open for every later datagram, wherever it goes"""
+        if self._type != SOCK_DGRAM:
+            raise RuntimeError("sendto() needs a SOCK_DGRAM socket")
+        if self._remote is None:
+            await self.connect(address)
+        return await self._interface.socket_send(data, link_id=self._link_id, remote=address)
+
+    async def recvfrom(self, bufsize: int) -> Tuple[bytes, Tuple[str, int]]:
+        """Receive one datagram of up to 'bufsize' bytes, returns it and the
+        address it came from"""
+        buffer = bytearray(bufsize)
+        size, address = await self.recvfrom_into(buffer)
+        return bytes(buffer[:size]), address
+
+    async def recvfrom_into(
+        self, buffer: WriteableBuffer, nbytes: int = 0
+    ) -> Tuple[int, Tuple[str, int]]:
+        """Receive one datagram into 'buffer', up to 'nbytes' bytes (all of
+        'buffer' if 0) of it, returns the number of bytes and the address it
+        came from. What doesn't fit is dropped"""
+        size, address = await self._interface.socket_receive_from(
+            buffer, nbytes, timeout=self._timeout, link_id=self._link_id
+        )
+        return size, address or self._remote
+
+    async def readline(self) -> bytes:
+        """Attempt to return as many bytes as we can up to but not including '\r\n'"""
+        ring = self._ring
+        end = ring.find(b"\r\n")
+        while end < 0 and ring.free:
+            # there's no line already in there, read some more
+            scanned = len(ring)
+            got = await self._interface.socket_receive_into(
+                ring.free_view(), timeout=3, link_id=self._link_id
+            )
+            if not got:
+                break
+            ring.commit(got)
+            end = ring.find(b"\r\n", max(0, scanned - 1))
+        if end < 0:
+            end = len(ring)  # no more coming, or a line longer than the ring
+        firstline = ring.peek(0, end)
+        ring.skip(end + 2)
+        return firstline
+
+    async def recv(self, num: int = 0) -> bytes:
+        """Read up to 'num' bytes from the socket, this may be buffered internally!
+        If 'num' isnt specified, return everything in the buffer."""
+        ring = self._ring
+        if num == 0:
+            # read as much as we can
+            ret = ring.peek(0, len(ring)) + await self._interface.socket_receive(
+                timeout=self._timeout, link_id=self._link_id
+            )
+            ring.clear()
+            return ret
+        ret = bytearray(num)
+        got = await self.recv_into(ret)
+        return bytes(memoryview(ret)[:got])
+
+    async def recv_into(self, buffer: WriteableBuffer, nbytes: int = 0) -> int:
+        """Read up to 'nbytes' bytes (all of 'buffer' if 0) from the socket into
+        'buffer', returns the number of bytes read"""
+        if not nbytes:
+            nbytes = len(buffer)
+        if self._ring:
+            return self._ring.readinto(memoryview(buffer)[:nbytes])
+        return await self._interface.socket_receive_into(
+            buffer, nbytes, timeout=self._timeout, link_id=self._link_id
+        )
+
+    async def close(self) -> None:
+        """Close the socket, after reading whatever remains. The connection
+        may be kept open for reuse, see ESP_ATcontrol.park_link(). Closing a
+        socket that isn't connected does nothing"""
+        if not self._owns_link:
+            return  # never connected or already closed, the link isn't ours
+        if self._type == SOCK_STREAM:
+            # read whatever's left
+            self._ring.write(
+                await self._interface.socket_receive(timeout=self._timeout, link_id=self._link_id)
+            )
+        if self._type == SOCK_STREAM and self._remote:
+            # parks it, or closes it and releases the link
+            await self._interface.park_link(self._link_id, *self._remote)
+        else:
+            await self._interface.socket_disconnect(self._link_id)
+            self._interface.esp.release_link(self._link_id)
+        self._owns_link = False
+        self._remote = None
+
+    def settimeout(self, value: int) -> None:
+        """Set the read timeout for sockets, if value is 0 it will block"""
+        self._timeout = value
+
+
+class SocketPool:
+    """The functions of this module bound to one AsyncESP_ATcontrol rather than
+    the one given to set_interface(), so several ESP modules on their own UARTs
+    can each have a pool. getaddrinfo() and the socket methods are coroutines,
+    so this is no pool for adafruit_requests, use the sockets directly:
+
+        pool = SocketPool(esp)
+        address = (await pool.getaddrinfo("example.com", 80))[0][-1]
+        sock = pool.socket()
+        await sock.connect(address)
+        await sock.send(b"GET / HTTP/1.0\r\nHost: example.com\r\n\r\n")
+        status = await sock.readline()
+    """
+
+    SOCK_STREAM = SOCK_STREAM
+    SOCK_DGRAM = SOCK_DGRAM
+    AF_INET = AF_INET
+
+    def __init__(self, iface: AsyncESP_ATcontrol) -> None:
+        self._interface = iface
+
+    def set_interface(self, iface: AsyncESP_ATcontrol) -> None:
+        """Bind the pool to 'iface', connection manager's create_fake_ssl_context() calls this"""
+        self._interface = iface
+
+    async def getaddrinfo(
+        self,
+        host: str,
+        port: int,
+        family: int = 0,
+        socktype: int = 0,
+        proto: int = 0,
+        flags: int = 0,
+    ) -> List[Tuple[int, int, int, str, Tuple[str, int]]]:
+        """Given a hostname and a port name, return a 'socket.getaddrinfo'
+        compatible list of tuples. Honestly, we ignore anything but host & port"""
+        if not isinstance(port, int):
+            raise RuntimeError("port must be an integer")
+        ipaddr = await self._interface.nslookup(host)
+        return [(AF_INET, socktype, proto, "", (ipaddr, port))]
+
+    def socket(
+        self,
+        family: int = AF_INET,
+        type: int = SOCK_STREAM,
+        proto: int = 0,
+        fileno: Optional[int] = None,
+        *,
+        buffer_size: int = 2048,
+    ) -> "socket":
+        """A new socket on this pool's interface"""
+        return socket(
+            family, type, proto, fileno, buffer_size=buffer_size, interface=self._interface
+        )
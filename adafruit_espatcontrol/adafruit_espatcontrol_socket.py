@@ -9,6 +9,8 @@ from micropython import const
 try:
     from typing import List, Optional, Tuple
 
+    from circuitpython_typing import ReadableBuffer, WriteableBuffer
+
     from .adafruit_espatcontrol import ESP_ATcontrol
 except ImportError:
     pass
@@ -17,12 +19,14 @@ _the_interface = None
 
 
 def set_interface(iface: ESP_ATcontrol) -> None:
-    """Helper to set the global internet interface"""
+    """Helper to set the global internet interface, used by the module level
+    functions and by sockets not made through a SocketPool"""
     global _the_interface  # noqa: PLW0603
     _the_interface = iface
 
 
 SOCK_STREAM = const(1)
+SOCK_DGRAM = const(2)
 AF_INET = const(2)
 
 
@@ -42,9 +46,102 @@ def getaddrinfo(
     return [(AF_INET, socktype, proto, "", (ipaddr, port))]
 
 
+class _RingBuffer:
+    """Fixed capacity FIFO of received bytes. It is filled in place through
+    free_view() and drained by copying out, so nothing is reallocated or
+    shifted as lines and chunks are taken off the front"""
+
+    SCAN_WINDOW = 64  # bytes find() copies out and searches at a time
+
+    def __init__(self, capacity: int) -> None:
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._capacity = capacity
+        self._read = 0  # index of the oldest byte
+        self._count = 0  # number of buffered bytes
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def free(self) -> int:
+        """How many more bytes fit"""
+        return self._capacity - self._count
+
+    def clear(self) -> None:
+        """Drop everything buffered"""
+        self._read = 0
+        self._count = 0
+
+    def free_view(self) -> memoryview:
+        """The contiguous free space after the buffered bytes, fill it and
+        then commit() how much was put there"""
+        if not self._count:
+            self._read = 0  # start over at the front, for the biggest view
+        if self._count == self._capacity:
+            return self._view[0:0]
+        write = (self._read + self._count) % self._capacity
+        return self._view[write : self._read if write < self._read else self._capacity]
+
+    def commit(self, nbytes: int) -> None:
+        """Add the 'nbytes' just written into free_view()"""
+        self._count += nbytes
+
+    def write(self, data: ReadableBuffer) -> int:
+        """Copy in as much of 'data' as fits, returns how many bytes that was"""
+        data = memoryview(data)
+        written = 0
+        while written < len(data) and self.free:
+            view = self.free_view()
+            size = min(len(view), len(data) - written)
+            view[:size] = data[written : written + size]
+            self.commit(size)
+            written += size
+        return written
+
+    def readinto(self, buffer: WriteableBuffer) -> int:
+        """Move as many of the oldest bytes as fit into 'buffer', returns the count"""
+        want = min(len(buffer), self._count)
+        got = 0
+        while got < want:
+            size = min(want - got, self._capacity - self._read)
+            buffer[got : got + size] = self._view[self._read : self._read + size]
+            self.skip(size)
+            got += size
+        return got
+
+    def skip(self, nbytes: int) -> None:
+        """Drop the oldest 'nbytes' bytes"""
+        nbytes = min(nbytes, self._count)
+        self._read = (self._read + nbytes) % self._capacity
+        self._count -= nbytes
+
+    def peek(self, offset: int, size: int) -> bytes:
+        """A copy of 'size' buffered bytes starting 'offset' bytes in"""
+        start = (self._read + offset) % self._capacity
+        first = min(size, self._capacity - start)
+        if first == size:
+            return bytes(self._view[start : start + size])
+        return bytes(self._view[start:]) + bytes(self._view[: size - first])
+
+    def find(self, sub: bytes, start: int = 0) -> int:
+        """Offset of 'sub' in the buffered bytes from 'start' on, or -1. Only
+        copies out a window at a time, so finding a short line stays cheap"""
+        while start + len(sub) <= self._count:
+            window = self.peek(start, min(self.SCAN_WINDOW, self._count - start))
+            idx = window.find(sub)
+            if idx >= 0:
+                return start + idx
+            start += len(window) - len(sub) + 1
+        return -1
+
+
 class socket:
     """A simplified implementation of the Python 'socket' class, for connecting
-    through an interface to a remote device"""
+    through an interface to a remote device. Received data is buffered in a
+    ring of 'buffer_size' bytes, which is also the longest line readline()
+    returns whole. It talks to 'interface', or the one given to set_interface()
+    if that's None"""
 
     def __init__(
         self,
@@ -52,57 +149,202 @@ class socket:
         type: int = SOCK_STREAM,
         proto: int = 0,
         fileno: Optional[int] = None,
+        *,
+        buffer_size: int = 2048,
+        interface: Optional[ESP_ATcontrol] = None,
     ) -> None:
         if family != AF_INET:
             raise RuntimeError("Only AF_INET family supported")
-        if type != SOCK_STREAM:
-            raise RuntimeError("Only SOCK_STREAM type supported")
-        self._buffer = b""
+        if type not in {SOCK_STREAM, SOCK_DGRAM}:
+            raise RuntimeError("Only SOCK_STREAM and SOCK_DGRAM types supported")
+        self._interface = interface or _the_interface
+        self._type = type
+        self._remote = None
+        self._ring = _RingBuffer(buffer_size)
+        self._link_id = 0
+        self._owns_link = False
         self.settimeout(0)
 
     def connect(self, address: Tuple[str, int], conntype: Optional[str] = None) -> None:
         """Connect the socket to the 'address' (which should be dotted quad IP). 'conntype'
-        is an extra that may indicate SSL or not, depending on the underlying interface
+        is an extra that may indicate SSL or not, depending on the underlying interface.
+        A SOCK_DGRAM socket is always UDP. A SOCK_STREAM socket reuses a connection
+        to the same place that the interface's link pool kept open, if there is one
         """
         host, port = address
+        if self._type == SOCK_DGRAM:
+            conntype = self._interface.TYPE_UDP
+        else:
+            link_id = self._interface.take_parked_link(host, port, conntype)
+            if link_id is not None:
+                if self._owns_link and link_id != self._link_id:
+                    self._interface.release_link(self._link_id)
+                self._link_id = link_id
+                self._owns_link = True
+                self._remote = address
+                self._ring.clear()
+                return
 
-        if not _the_interface.socket_connect(conntype, host, port, keepalive=10, retries=3):
+        if not self._owns_link:
+            self._link_id = self._interface.allocate_link()
+            self._owns_link = True
+        if not self._interface.socket_connect(
+            conntype, host, port, keepalive=10, retries=None, link_id=self._link_id
+        ):
             raise RuntimeError("Failed to connect to host", host)
-        self._buffer = b""
+        self._remote = address
+        self._ring.clear()
+
+    def send(self, data: bytes) -> int:
+        """Send some data to the socket, returns how many bytes were sent"""
+        return self._interface.socket_send(data, link_id=self._link_id)
+
+    def sendto(self, data: bytes, address: Tuple[str, int]) -> int:
+        """Send a datagram to 'address' (which should be dotted quad IP), returns
+        how many bytes were sent. The first one opens the UDP link, which then
+        stays open for every later datagram, wherever it goes"""
+        if self._type != SOCK_DGRAM:
+            raise RuntimeError("sendto() needs a SOCK_DGRAM socket")
+        if self._remote is None:
+            self.connect(address)
+        return self._interface.socket_send(data, link_id=self._link_id, remote=address)
+
+    def recvfrom(self, bufsize: int) -> Tuple[bytes, Tuple[str, int]]:
+        """Receive one datagram of up to 'bufsize' bytes, returns it and the
+        address it came from"""
+        buffer = bytearray(bufsize)
+        size, address = self.recvfrom_into(buffer)
+        return bytes(buffer[:size]), address
 
-    def send(self, data: bytes) -> None:  # noqa: PLR6301
-        """Send some data to the socket"""
-        _the_interface.socket_send(data)
+    def recvfrom_into(
+        self, buffer: WriteableBuffer, nbytes: int = 0
+    ) -> Tuple[int, Tuple[str, int]]:
+        """Receive one datagram into 'buffer', up to 'nbytes' bytes (all of
+        'buffer' if 0) of it, returns the number of bytes and the address it
+        came from. What doesn't fit is dropped"""
+        size, address = self._interface.socket_receive_from(
+            buffer, nbytes, timeout=self._timeout, link_id=self._link_id
+        )
+        return size, address or self._remote
 
     def readline(self) -> bytes:
         """Attempt to return as many bytes as we can up to but not including '\r\n'"""
-        if b"\r\n" not in self._buffer:
+        ring = self._ring
+        end = ring.find(b"\r\n")
+        while end < 0 and ring.free:
             # there's no line already in there, read some more
-            self._buffer = self._buffer + _the_interface.socket_receive(timeout=3)
-            # print(self._buffer)
-        firstline, self._buffer = self._buffer.split(b"\r\n", 1)
+            scanned = len(ring)
+            got = self._interface.socket_receive_into(
+                ring.free_view(), timeout=3, link_id=self._link_id
+            )
+            if not got:
+                break
+            ring.commit(got)
+            end = ring.find(b"\r\n", max(0, scanned - 1))
+        if end < 0:
+            end = len(ring)  # no more coming, or a line longer than the ring
+        firstline = ring.peek(0, end)
+        ring.skip(end + 2)
         return firstline
 
     def recv(self, num: int = 0) -> bytes:
         """Read up to 'num' bytes from the socket, this may be buffered internally!
-        If 'num' isnt specified, return everything in the buffer."""
+        Returns as soon as there's some data, so it may be less than 'num'.
+        If 'num' isnt specified, return everything until the socket closes or
+        nothing arrives for the timeout."""
+        ring = self._ring
         if num == 0:
-            # read as much as we can
-            ret = self._buffer + _the_interface.socket_receive(timeout=self._timeout)
-            self._buffer = b""
-        else:
-            if self._buffer == b"":
-                self._buffer = self._buffer + _the_interface.socket_receive(timeout=self._timeout)
-            ret = self._buffer[:num]
-            self._buffer = self._buffer[num:]
-        return ret
+            ret = bytearray(ring.peek(0, len(ring)))
+            ring.clear()
+            for chunk in self._interface.iter_receive(self._timeout, link_id=self._link_id):
+                ret += chunk
+            return bytes(ret)
+        ret = bytearray(num)
+        got = self.recv_into(ret)
+        return bytes(memoryview(ret)[:got])
+
+    def recv_into(self, buffer: WriteableBuffer, nbytes: int = 0) -> int:
+        """Read up to 'nbytes' bytes (all of 'buffer' if 0) from the socket into
+        'buffer', returns the number of bytes read"""
+        if not nbytes:
+            nbytes = len(buffer)
+        if self._ring:
+            return self._ring.readinto(memoryview(buffer)[:nbytes])
+        return self._interface.socket_receive_into(
+            buffer, nbytes, timeout=self._timeout, link_id=self._link_id
+        )
 
     def close(self) -> None:
-        """Close the socket, after reading whatever remains"""
-        # read whatever's left
-        self._buffer = self._buffer + _the_interface.socket_receive(timeout=self._timeout)
-        _the_interface.socket_disconnect()
+        """Close the socket, after reading whatever remains. The connection
+        may be kept open for reuse, see ESP_ATcontrol.park_link(). Closing a
+        socket that isn't connected does nothing"""
+        if not self._owns_link:
+            return  # never connected or already closed, the link isn't ours
+        if self._type == SOCK_STREAM:
+            # read whatever's left
+            for chunk in self._interface.iter_receive(self._timeout, link_id=self._link_id):
+                self._ring.write(chunk)
+        if self._type == SOCK_STREAM and self._remote:
+            # parks it, or closes it and releases the link
+            self._interface.park_link(self._link_id, *self._remote)
+        else:
+            self._interface.socket_disconnect(self._link_id)
+            self._interface.release_link(self._link_id)
+        self._owns_link = False
+        self._remote = None
 
     def settimeout(self, value: int) -> None:
         """Set the read timeout for sockets, if value is 0 it will block"""
         self._timeout = value
+
+
+class SocketPool:
+    """The functions of this module bound to one ESP_ATcontrol rather than
+    the one given to set_interface(), so several ESP modules on their own UARTs
+    can each have a pool:
+
+        pool = SocketPool(esp)
+        ssl_context = adafruit_connection_manager.create_fake_ssl_context(pool, esp)
+        requests = adafruit_requests.Session(pool, ssl_context)
+    """
+
+    SOCK_STREAM = SOCK_STREAM
+    SOCK_DGRAM = SOCK_DGRAM
+    AF_INET = AF_INET
+
+    def __init__(self, iface: ESP_ATcontrol) -> None:
+        self._interface = iface
+
+    def set_interface(self, iface: ESP_ATcontrol) -> None:
+        """Bind the pool to 'iface', connection manager's create_fake_ssl_context() calls this"""
+        self._interface = iface
+
+    def getaddrinfo(
+        self,
+        host: str,
+        port: int,
+        family: int = 0,
+        socktype: int = 0,
+        proto: int = 0,
+        flags: int = 0,
+    ) -> List[Tuple[int, int, int, str, Tuple[str, int]]]:
+        """Given a hostname and a port name, return a 'socket.getaddrinfo'
+        compatible list of tuples. Honestly, we ignore anything but host & port"""
+        if not isinstance(port, int):
+            raise RuntimeError("port must be an integer")
+        ipaddr = self._interface.nslookup(host)
+        return [(AF_INET, socktype, proto, "", (ipaddr, port))]
+
+    def socket(
+        self,
+        family: int = AF_INET,
+        type: int = SOCK_STREAM,
+        proto: int = 0,
+        fileno: Optional[int] = None,
+        *,
+        buffer_size: int = 2048,
+    ) -> "socket":
+        """A new socket on this pool's interface"""
+        return socket(
+            family, type, proto, fileno, buffer_size=buffer_size, interface=self._interface
+        )
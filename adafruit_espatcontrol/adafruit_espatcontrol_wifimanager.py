@@ -14,8 +14,8 @@ WiFi Manager for making ESP32 AT Control as WiFi much easier
 import adafruit_connection_manager
 import adafruit_requests
 
-import adafruit_espatcontrol.adafruit_espatcontrol_socket as pool
-from adafruit_espatcontrol.adafruit_espatcontrol import ESP_ATcontrol
+from adafruit_espatcontrol.adafruit_espatcontrol import ESP_ATcontrol, OKError, RetryPolicy
+from adafruit_espatcontrol.adafruit_espatcontrol_socket import SocketPool, set_interface
 
 try:
     from typing import Any, Dict, Optional, Tuple, Union
@@ -38,6 +38,7 @@ class ESPAT_WiFiManager:
         attempts: int = 2,
         enterprise: bool = False,
         debug: bool = False,
+        retry_policy: Optional[RetryPolicy] = None,
     ):
         """
         :param ESP_SPIcontrol esp: The ESP object we are using
@@ -47,6 +48,8 @@ class ESPAT_WiFiManager:
         :param int attempts: (Optional) Unused, only for compatibility for old code
         :param bool enterprise: (Optional) If True, try to connect to Enterprise AP
         :param bool debug: (Optional) Print debug messages during operation
+        :param RetryPolicy retry_policy: (Optional) How to retry connecting to the
+            AP when it fails, by default we give up after the first failed connect()
         """
         # Read the settings
         self._esp = esp
@@ -56,8 +59,14 @@ class ESPAT_WiFiManager:
         self.statuspix = status_pixel
         self.pixel_status(0)
         self.enterprise = enterprise
-
-        # create requests session
+        self.retry_policy = retry_policy or RetryPolicy(attempts=1)
+
+        # create requests session, with a socket pool of our own so every
+        # manager can drive its own ESP module. Code using the module level
+        # socket functions still expects us to set the interface, as
+        # create_fake_ssl_context() did when it was handed the module
+        set_interface(self._esp)
+        pool = SocketPool(self._esp)
         ssl_context = adafruit_connection_manager.create_fake_ssl_context(pool, self._esp)
         self._requests = adafruit_requests.Session(pool, ssl_context)
 
@@ -78,18 +87,23 @@ class ESPAT_WiFiManager:
         """
         Attempt to connect to WiFi using the current settings
         """
-        try:
-            if self.debug:
-                print("Connecting to AP...")
-            self.pixel_status((100, 0, 0))
-            if self.enterprise is False:
-                self._esp.connect(self.secrets, timeout=timeout, retries=retries)
-            else:
-                self._esp.connect_enterprise(self.secrets, timeout=timeout, retries=retries)
-            self.pixel_status((0, 100, 0))
-        except (ValueError, RuntimeError) as error:
-            print("Failed to connect\n", error)
-            raise
+        retry = self.retry_policy.start("connect")
+        while True:
+            try:
+                if self.debug:
+                    print("Connecting to AP...")
+                self.pixel_status((100, 0, 0))
+                if self.enterprise is False:
+                    self._esp.connect(self.secrets, timeout=timeout, retries=retries)
+                else:
+                    self._esp.connect_enterprise(self.secrets, timeout=timeout, retries=retries)
+                self.pixel_status((0, 100, 0))
+                retry.done()
+                return
+            except (ValueError, RuntimeError, OKError) as error:
+                print("Failed to connect\n", error)
+                if not retry.sleep():
+                    raise
 
     def set_conntype(self, url: str) -> None:
         """set the connection-type according to protocol"""
@@ -0,0 +1,79 @@
+# SPDX-FileCopyrightText: 2026 Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+# Download the same file twice, once through the framed socket path and once
+# in passthrough (transparent) mode, and print the throughput of each
+
+import time
+
+import board
+import busio
+from digitalio import DigitalInOut, Direction
+
+from adafruit_espatcontrol import adafruit_espatcontrol
+
+# Get wifi details and more from a secrets.py file
+try:
+    from secrets import secrets
+except ImportError:
+    print("WiFi secrets are kept in secrets.py, please add them there!")
+    raise
+
+# Debug Level
+# Change the Debug Flag if you have issues with AT commands
+debugflag = False
+
+HOST = "wifitest.adafruit.com"
+REQUEST = b"GET /testwifi/index.html HTTP/1.0\r\nHost: wifitest.adafruit.com\r\n\r\n"
+
+if board.board_id == "challenger_rp2040_wifi":
+    RX = board.ESP_RX
+    TX = board.ESP_TX
+    resetpin = DigitalInOut(board.WIFI_RESET)
+    rtspin = False
+    uart = busio.UART(TX, RX, baudrate=11520, receiver_buffer_size=2048)
+    esp_boot = DigitalInOut(board.WIFI_MODE)
+    esp_boot.direction = Direction.OUTPUT
+    esp_boot.value = True
+else:
+    RX = board.ESP_TX
+    TX = board.ESP_RX
+    resetpin = DigitalInOut(board.ESP_WIFI_EN)
+    rtspin = DigitalInOut(board.ESP_CTS)
+    uart = busio.UART(TX, RX, timeout=0.1)
+    esp_boot = DigitalInOut(board.ESP_BOOT_MODE)
+    esp_boot.direction = Direction.OUTPUT
+    esp_boot.value = True
+
+print("ESP AT commands")
+esp = adafruit_espatcontrol.ESP_ATcontrol(
+    uart, 115200, reset_pin=resetpin, rts_pin=rtspin, debug=debugflag
+)
+print("Resetting ESP module")
+esp.hard_reset()
+esp.connect(secrets)
+
+# Framed: AT+CIPSEND for the request, +IPD frames for the reply
+esp.socket_connect(esp.TYPE_TCP, HOST, 80)
+stamp = time.monotonic()
+esp.socket_send(REQUEST)
+framed = 0
+for chunk in esp.iter_receive(timeout=2):
+    framed += len(chunk)
+    elapsed = time.monotonic() - stamp  # up to the last byte, not the idle timeout
+print("Framed: %d bytes in %0.2f s, %d bytes/s" % (framed, elapsed, framed / elapsed))
+esp.socket_disconnect()
+
+# Passthrough: the UART is a raw pipe to the server
+esp.socket_connect(esp.TYPE_TCP, HOST, 80)
+buffer = bytearray(1460)
+with esp.passthrough(timeout=2) as pipe:
+    stamp = time.monotonic()
+    pipe.write(REQUEST)
+    while pipe.readinto(buffer):
+        elapsed = time.monotonic() - stamp
+print(
+    "Passthrough: %d bytes in %0.2f s, %d bytes/s"
+    % (pipe.bytes_read, elapsed, pipe.bytes_read / elapsed)
+)
+esp.socket_disconnect()
@@ -0,0 +1,142 @@
+# SPDX-FileCopyrightText: 2026 Adafruit Industries
+#
+# SPDX-License-Identifier: MIT
+
+"""A fake ESP-AT module on a fake UART, for running the drivers under CPython"""
+
+import re
+import time
+
+import pytest
+
+from adafruit_espatcontrol.adafruit_espatcontrol import ESP_ATcontrol
+
+
+class FakeUART:
+    """Answers the AT commands written to it from a script of replies. Replies
+    and fed data can be delayed, they show up in the UART once they're due"""
+
+    def __init__(self, baudrate: int = 115200) -> None:
+        self.baudrate = baudrate
+        self.writes = []
+        self.commands = []
+        self._rx = bytearray()
+        self._line = bytearray()
+        self._pending = []  # (due, data)
+        self._replies = []  # (command prefix, reply, delay)
+        self._send_left = 0  # bytes of CIPSEND data still to come
+        self.connected = False  # between AT+CIPSTART and AT+CIPCLOSE
+        self.send_results = []  # what the next CIPSENDs end with, SEND OK after those
+
+    def respond(self, prefix: bytes, reply: bytes, delay: float = 0, times: int = 0) -> None:
+        """Answer commands that start with 'prefix' with 'reply', 'delay'
+        seconds later, for the next 'times' of them or 0 for all. Later calls
+        win over earlier ones for the same prefix"""
+        self._replies.insert(0, [prefix, reply, delay, times])
+
+    def feed(self, data: bytes, delay: float = 0) -> None:
+        """Have 'data' arrive unasked, 'delay' seconds from now"""
+        self._pending.append((time.monotonic() + delay, bytes(data)))
+
+    def _due(self) -> None:
+        now = time.monotonic()
+        for entry in list(self._pending):
+            if entry[0] <= now:
+                self._rx += entry[1]
+                self._pending.remove(entry)
+
+    @property
+    def in_waiting(self) -> int:
+        self._due()
+        return len(self._rx)
+
+    def read(self, nbytes: int = None) -> bytes:
+        self._due()
+        if nbytes is None:
+            nbytes = len(self._rx)
+        data = bytes(self._rx[:nbytes])
+        del self._rx[:nbytes]
+        return data or None
+
+    def readinto(self, buffer, nbytes: int = None) -> int:
+        self._due()
+        nbytes = min(len(buffer) if nbytes is None else nbytes, len(self._rx))
+        buffer[:nbytes] = self._rx[:nbytes]
+        del self._rx[:nbytes]
+        return nbytes
+
+    def reset_input_buffer(self) -> None:
+        self._rx = bytearray()
+
+    def write(self, data: bytes) -> int:
+        data = bytes(data)
+        self.writes.append(data)
+        if self._send_left:
+            # data mode after AT+CIPSEND
+            taken = data[: self._send_left]
+            self._send_left -= len(taken)
+            if not self._send_left:
+                result = self.send_results.pop(0) if self.send_results else b"SEND OK"
+                self.feed(b"\r\nRecv %d bytes\r\n\r\n%s\r\n" % (len(taken), result))
+            return len(data)
+        self._line += data
+        while b"\r\n" in self._line:
+            command, _, self._line = bytes(self._line).partition(b"\r\n")
+            self._line = bytearray(self._line)
+            self.commands.append(command)
+            self._answer(command)
+        return len(data)
+
+    def _answer(self, command: bytes) -> None:
+        if command.startswith(b"AT+CIPSTART"):
+            self.connected = True
+        elif command.startswith(b"AT+CIPCLOSE"):
+            self.connected = False
+        if command.startswith(b"AT+CIPSEND="):
+            self._send_left = int(re.findall(rb"(\d+)", command)[-1])
+            self.feed(b"OK\r\n> ")
+            return
+        for entry in self._replies:
+            prefix, reply, delay, times = entry
+            if command.startswith(prefix):
+                if times:
+                    entry[3] -= 1
+                    if entry[3] == 0:
+                        self._replies.remove(entry)
+                self.feed(reply, delay)
+                return
+        if command == b"AT+CIPSTATE?" and self.connected:
+            self.feed(b'+CIPSTATE:0,"TCP","10.0.0.1",80,1,0\r\nOK\r\n')
+            return
+        self.feed(b"OK\r\n")
+
+
+@pytest.fixture
+def uart() -> FakeUART:
+    fake = FakeUART()
+    fake.respond(b"AT+CWSTATE?", b'+CWSTATE:2,"ssid"\r\nOK\r\n')
+    fake.respond(b"AT+CIPSTART", b"CONNECT\r\n\r\nOK\r\n")
+    fake.respond(b"AT+CIPDOMAIN", b'+CIPDOMAIN:"10.0.0.1"\r\nOK\r\n')
+    return fake
+
+
+@pytest.fixture
+def esp(uart: FakeUART) -> ESP_ATcontrol:
+    return ESP_ATcontrol(uart, 115200)
+
+
+class Clock:
+    """Stands in for time.monotonic(), moved on by hand"""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    fake = Clock()
+    monkeypatch.setattr(time, "monotonic", fake)
+    return fake
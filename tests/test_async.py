@@ -0,0 +1,125 @@
+# SPDX-FileCopyrightText: 2026 Adafruit Industries
+#
+# SPDX-License-Identifier: MIT
+
+"""AsyncESP_ATcontrol runs the ESP_ATcontrol steps without blocking the loop"""
+
+import asyncio
+import time
+
+from adafruit_espatcontrol import adafruit_espatcontrol_async_socket as asocket
+from adafruit_espatcontrol.adafruit_espatcontrol import ESP_ATcontrol
+from adafruit_espatcontrol.adafruit_espatcontrol_async import AsyncESP_ATcontrol
+
+
+async def _ticker(ticks: list, count: int = 10) -> None:
+    for _ in range(count):
+        ticks.append(time.monotonic())
+        await asyncio.sleep(0.01)
+
+
+def test_slow_reply_lets_other_tasks_run(esp, uart):
+    uart.respond(b"AT+CIPSTART", b"CONNECT\r\n\r\nOK\r\n", delay=0.3)
+    aesp = AsyncESP_ATcontrol(esp)
+    ticks = []
+
+    async def main():
+        ticker = asyncio.create_task(_ticker(ticks))
+        connected = await aesp.socket_connect("TCP", "10.0.0.1", 80)
+        await ticker
+        return connected
+
+    assert asyncio.run(main())
+    assert len(ticks) == 10
+    # the ticker ran to the end while CIPSTART was waiting on its reply
+    assert ticks[-1] - ticks[0] < 0.3
+
+
+def test_receive_into_closed_link_returns_now(esp, uart):
+    aesp = AsyncESP_ATcontrol(esp)
+
+    async def main():
+        await aesp.socket_connect("TCP", "10.0.0.1", 80)
+        uart.feed(b"+IPD,5:hello\r\nCLOSED\r\n")
+        buffer = bytearray(16)
+        got = await aesp.socket_receive_into(buffer, timeout=5)
+        assert bytes(buffer[:got]) == b"hello"
+        start = time.monotonic()
+        assert await aesp.socket_receive_into(buffer, timeout=5) == 0
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) < 1
+
+
+def test_status_is_pipelined(esp, uart):
+    aesp = AsyncESP_ATcontrol(esp)
+    assert asyncio.run(aesp.status(force=True)) == esp.STATUS_APCONNECTED
+    # CWSTATE? and CIPSTATE? went out together
+    assert uart.writes[0] == b"AT+CWSTATE?\r\nAT+CIPSTATE?"
+    assert uart.commands == [b"AT+CWSTATE?", b"AT+CIPSTATE?"]
+
+
+def test_idle_receive_lets_commands_through(esp, uart):
+    aesp = AsyncESP_ATcontrol(esp)
+    done = []
+
+    async def receiver():
+        data = await aesp.socket_receive(timeout=1)
+        done.append(("receive", data))
+
+    async def commander():
+        await asyncio.sleep(0.05)
+        done.append(("command", await aesp.at_response("AT+GMR")))
+        uart.feed(b"+IPD,2:hi\r\n")
+
+    async def main():
+        await aesp.socket_connect("TCP", "10.0.0.1", 80)
+        await asyncio.gather(receiver(), commander())
+
+    asyncio.run(main())
+    assert [name for name, _ in done] == ["command", "receive"]
+    assert done[1][1] == b"hi"
+
+
+def test_passive_receive_waits_without_blocking(uart):
+    esp = ESP_ATcontrol(uart, 115200, passive_receive=True)
+    aesp = AsyncESP_ATcontrol(esp)
+    uart.respond(b"AT+CIPRECVLEN?", b"+CIPRECVLEN:5\r\nOK\r\n")
+    uart.respond(b"AT+CIPRECVLEN?", b"+CIPRECVLEN:0\r\nOK\r\n", times=1)
+    uart.respond(b"AT+CIPRECVDATA", b"+CIPRECVDATA:5,hello\r\nOK\r\n")
+    done = []
+
+    async def receiver():
+        buffer = bytearray(16)
+        got = await aesp.socket_receive_into(buffer, timeout=2)
+        done.append(("receive", bytes(buffer[:got])))
+
+    async def commander():
+        await asyncio.sleep(0.05)
+        done.append(("command", await aesp.at_response("AT+GMR")))
+        uart.feed(b"+IPD,5\r\n", delay=0.1)  # the notice, the data waits on the module
+
+    async def main():
+        await aesp.socket_connect("TCP", "10.0.0.1", 80)
+        await asyncio.gather(receiver(), commander())
+
+    asyncio.run(main())
+    assert done == [("command", b""), ("receive", b"hello")]
+
+
+def test_sync_and_async_send_alike(esp, uart):
+    aesp = AsyncESP_ATcontrol(esp)
+
+    async def main():
+        await aesp.socket_connect("TCP", "10.0.0.1", 80)
+        return await aesp.socket_send(b"GET / HTTP/1.0\r\n\r\n")
+
+    assert asyncio.run(main()) == 18
+    assert esp.socket_send(b"ping") == 4
+
+
+def test_closing_an_unconnected_async_socket_does_nothing(uart):
+    esp = ESP_ATcontrol(uart, 115200, multi_link=True)
+    pool = asocket.SocketPool(AsyncESP_ATcontrol(esp))
+    asyncio.run(pool.socket().close())
+    assert not uart.commands
@@ -0,0 +1,376 @@
+# SPDX-FileCopyrightText: 2026 Adafruit Industries
+#
+# SPDX-License-Identifier: MIT
+
+"""ESP_ATcontrol against a fake module"""
+
+import json
+import random
+import traceback
+
+import pytest
+
+from adafruit_espatcontrol.adafruit_espatcontrol import (
+    DNSCache,
+    ESP_ATcontrol,
+    OKError,
+    RetryPolicy,
+)
+from adafruit_espatcontrol.adafruit_espatcontrol_socket import SocketPool
+
+
+def test_pipeline_resends_only_turned_away_commands(esp, uart):
+    # CIPSTATE? arrived while CWSTATE? ran, so the module turned it away
+    uart.respond(b"AT+CWSTATE?", b'+CWSTATE:2,"ssid"\r\nbusy p...\r\nOK\r\n', times=1)
+    uart.respond(b"AT+CIPSTATE?", b"", times=1)
+    replies = esp.at_pipeline(["AT+CWSTATE?", "AT+CIPSTATE?"])
+    assert replies == [b'+CWSTATE:2,"ssid"\r\n', b""]
+    assert uart.commands == [b"AT+CWSTATE?", b"AT+CIPSTATE?", b"AT+CIPSTATE?"]
+
+
+def test_pipeline_turned_away_from_the_start(esp, uart):
+    # the module was still busy before the pipeline, so neither command ran
+    uart.respond(b"AT+CWSTATE?", b"busy p...\r\n", times=1)
+    uart.respond(b"AT+CIPSTATE?", b"busy p...\r\n", times=1)
+    replies = esp.at_pipeline(["AT+CWSTATE?", "AT+CIPSTATE?"])
+    assert replies == [b'+CWSTATE:2,"ssid"\r\n', b""]
+    assert uart.commands[2:] == [b"AT+CWSTATE?", b"AT+CIPSTATE?"]
+
+
+def test_send_fail_is_reported_by_the_send_it_belongs_to(esp, uart):
+    assert esp.socket_connect("TCP", "10.0.0.1", 80)
+    uart.send_results = [b"SEND FAIL"]
+    with pytest.raises(RuntimeError):
+        esp.socket_send(b"ping")
+    assert esp.socket_send(b"pong") == 4
+
+
+def test_send_fail_midway_returns_what_went_out(esp, uart):
+    esp.SEND_CHUNK_SIZE = 4
+    assert esp.socket_connect("TCP", "10.0.0.1", 80)
+    uart.send_results = [b"SEND OK", b"SEND FAIL"]
+    assert esp.socket_send(b"0123456789") == 4
+
+
+def test_parked_link_with_data_is_not_reused(uart):
+    esp = ESP_ATcontrol(uart, 115200, multi_link=True, link_pool_size=2)
+    uart.respond(b"AT+CIPSTART", b"0,CONNECT\r\n\r\nOK\r\n")
+    uart.respond(b"AT+CIPSTATE?", b'+CIPSTATE:0,"TCP","10.0.0.1",80,1,0\r\nOK\r\n')
+    link_id = esp.allocate_link()
+    assert esp.socket_connect("TCP", "10.0.0.1", 80, link_id=link_id)
+    assert esp.park_link(link_id, "10.0.0.1", 80)
+    uart.feed(b"+IPD,0,5:stale\r\n")
+    assert esp.take_parked_link("10.0.0.1", 80, "TCP") is None
+    assert b"AT+CIPCLOSE=0" in uart.commands
+    assert not esp._rx_queues.get(link_id)
+
+
+def test_desync_counted_once_per_failed_command(esp, uart):
+    esp.set_retry_policy("AT+GMR", RetryPolicy(attempts=3, delay=0))
+    uart.respond(b"AT+GMR", b"")  # no reply at all
+    with pytest.raises(OKError):
+        esp.at_response("AT+GMR", timeout=0.05)
+    assert uart.commands.count(b"AT+GMR") == 3
+    assert esp._desyncs == 1
+
+
+def test_saved_baudrate_ignored_without_negotiation(uart, tmp_path):
+    path = tmp_path / "caps.json"
+    path.write_text(json.dumps({"baudrate": 921600}))
+    uart.respond(b"AT+GMR", b"AT version:2.2.0.0\r\nOK\r\n")
+    uart.respond(b"AT+CIPMUX?", b"+CIPMUX:0\r\nOK\r\n")
+    esp = ESP_ATcontrol(uart, 115200, capability_cache=str(path))
+    esp.begin()
+    assert uart.baudrate == 115200
+    assert not any(command.startswith(b"AT+UART_CUR=921600") for command in uart.commands)
+    assert "baudrate" not in json.loads(path.read_text())
+
+
+def test_warm_boot_keeps_the_saved_baudrate(uart, tmp_path):
+    path = tmp_path / "caps.json"
+    path.write_text(json.dumps({"baudrate": 921600}))
+    uart.respond(b"AT+GMR", b"AT version:2.2.0.0\r\nOK\r\n")
+    uart.respond(b"AT+CIPMUX?", b"+CIPMUX:0\r\nOK\r\n")
+    write = uart.write
+
+    def at_921600(data):  # the module is still at the rate the last boot left it
+        return write(data) if uart.baudrate == 921600 else len(data)
+
+    uart.write = at_921600
+    esp = ESP_ATcontrol(uart, 115200, capability_cache=str(path), negotiate_baudrate=True)
+    esp.set_retry_policy("AT", RetryPolicy(attempts=1))  # don't linger at 115200
+    esp.begin()
+    assert uart.baudrate == 921600
+    assert not any(command.startswith(b"AT+UART_CUR") for command in uart.commands)
+    assert json.loads(path.read_text())["baudrate"] == 921600
+
+
+def test_late_data_does_not_reach_the_next_connection(esp, uart):
+    assert esp.socket_connect("TCP", "10.0.0.1", 80)
+    uart.respond(b"AT+CIPCLOSE", b"+IPD,9:OLD-BYTES\r\nCLOSED\r\n\r\nOK\r\n", times=1)
+    esp.socket_disconnect()
+    assert esp.socket_connect("TCP", "10.0.0.1", 80)
+    uart.feed(b"+IPD,3:new")
+    assert esp.socket_receive(timeout=0.5) == b"new"
+
+
+def test_reader_reads_payload_straight_into_the_buffer(esp, uart):
+    targets = []
+    readinto = uart.readinto
+
+    def spy(buffer, nbytes=None):
+        targets.append(memoryview(buffer).obj)
+        return readinto(buffer, nbytes)
+
+    uart.readinto = spy
+    reader = esp._reader
+    uart.feed(b"ab")
+    reader.fill()  # two bytes already in the ring
+    uart.feed(bytes(range(100)))
+    buffer = bytearray(102)
+    assert reader.readinto(buffer) == 102
+    assert buffer == b"ab" + bytes(range(100))
+    assert targets[-1] is buffer  # not the ring
+
+
+def feed_header(header, data):
+    header.reset()
+    return header.feed(memoryview(data))
+
+
+def test_ipd_header_single_link(esp):
+    header = esp._ipd_header
+    assert feed_header(header, b"5:hello") == 2
+    assert header.done and not header.notice
+    assert (header.link_id, header.length, header.remote) == (0, 5, None)
+
+
+def test_ipd_header_multi_link(esp):
+    header = esp._ipd_header
+    assert feed_header(header, b"3,12:payload") == 5
+    assert header.done
+    assert (header.link_id, header.length) == (3, 12)
+
+
+def test_ipd_header_with_remote(esp):
+    header = esp._ipd_header
+    frame = b'1,4,"192.168.1.7",5353:'
+    assert feed_header(header, frame + b"data") == len(frame)
+    assert header.done
+    assert (header.link_id, header.length) == (1, 4)
+    assert header.remote == ("192.168.1.7", 5353)
+    frame = b'4,"fe80::1a2b:3cff:fe4d:5e6f",80:'
+    assert feed_header(header, frame + b"data") == len(frame)
+    assert header.done
+    assert (header.link_id, header.length) == (0, 4)
+    assert header.remote == ("fe80::1a2b:3cff:fe4d:5e6f", 80)
+
+
+def test_ipd_header_passive_notice(esp):
+    header = esp._ipd_header
+    assert feed_header(header, b"2,100\r\n") == 6
+    assert header.done and header.notice
+    assert (header.link_id, header.length) == (2, 100)
+
+
+def test_ipd_header_split_across_chunks(esp):
+    header = esp._ipd_header
+    assert feed_header(header, b"1,") == 2
+    assert header.feed(memoryview(b"25")) == 2
+    assert header.feed(memoryview(b":abc")) == 1
+    assert header.done
+    assert (header.link_id, header.length) == (1, 25)
+    assert feed_header(header, b'7,"10.0') == 7
+    assert header.feed(memoryview(b'.0.9",8')) == 7
+    assert not header.finished
+    assert header.feed(memoryview(b"0:xy")) == 2
+    assert header.done
+    assert (header.link_id, header.length, header.remote) == (0, 7, ("10.0.0.9", 80))
+
+
+def test_ipd_header_stops_at_the_bad_byte(esp):
+    header = esp._ipd_header
+    assert feed_header(header, b"12+IPD,3:abc") == 2  # leaves "+IPD," to be found
+    assert header.failed and not header.done
+    assert feed_header(header, b"x") == 0
+    assert header.failed
+    assert feed_header(header, b'1"2:') == 1  # a quote only opens a field
+    assert header.failed
+    assert feed_header(header, b"1,2,3,4,5:") == 7  # too many fields
+    assert header.failed
+    assert feed_header(header, b"1" * 80) == header.MAX_SIZE
+    assert header.failed
+    assert feed_header(header, b"a.b:") == 0
+    assert header.failed
+    assert feed_header(header, b"1.5:") == 4  # dots only belong in an IP
+    assert header.failed
+
+
+def make_ring(esp, size):
+    return SocketPool(esp).socket(buffer_size=size)._ring
+
+
+def test_ring_write_and_read_wrap_around(esp):
+    ring = make_ring(esp, 8)
+    assert ring.write(b"abcdef") == 6
+    out = bytearray(4)
+    assert ring.readinto(out) == 4 and out == b"abcd"
+    assert ring.write(b"ghijklmn") == 6  # only what fits
+    assert len(ring) == 8 and ring.free == 0
+    assert len(ring.free_view()) == 0
+    out = bytearray(10)
+    assert ring.readinto(out) == 8
+    assert out[:8] == b"efghijkl"
+    assert len(ring) == 0
+
+
+def test_ring_free_view_and_commit_wrap_around(esp):
+    ring = make_ring(esp, 8)
+    ring.write(b"123456")
+    ring.skip(4)
+    view = ring.free_view()
+    assert len(view) == 2  # up to the end
+    view[:] = b"78"
+    ring.commit(2)
+    view = ring.free_view()
+    assert len(view) == 4  # then from the front up to the oldest byte
+    view[:3] = b"9ab"
+    ring.commit(3)
+    assert ring.peek(0, len(ring)) == b"56789ab"
+    ring.skip(len(ring))
+    assert len(ring.free_view()) == 8  # empty starts over at the front
+
+
+def test_ring_find_across_the_wrap(esp):
+    ring = make_ring(esp, 8)
+    ring.write(b"xxxxz")
+    ring.skip(4)  # one byte left, so what's written next wraps
+    ring.write(b"ab\r\ncd")  # "\r" is the last byte before the wrap
+    assert ring.peek(0, len(ring)) == b"zab\r\ncd"
+    assert ring.find(b"\r\n") == 3
+    assert ring.find(b"\r\n", 4) == -1
+    assert ring.find(b"cd", 1) == 5
+    assert ring.find(b"cde") == -1
+
+
+def test_ring_find_across_scan_windows(esp):
+    ring = make_ring(esp, 200)
+    window = ring.SCAN_WINDOW
+    ring.write(b"." * 101)
+    ring.skip(100)
+    line = b"." + b"a" * (window - 2) + b"\r\n" + b"b" * 50 + b"\r\n"
+    ring.write(line[1:])  # wraps, and the first "\r\n" straddles two windows
+    assert ring.peek(0, len(ring)) == line
+    assert ring.find(b"\r\n") == window - 1
+    assert ring.find(b"\r\n", window) == len(line) - 2
+    assert ring.find(b"\r\n", len(line) - 1) == -1
+
+
+def test_module_restart_forgets_parked_links(uart):
+    esp = ESP_ATcontrol(uart, 115200, multi_link=True, link_pool_size=2)
+    uart.respond(b"AT+CIPSTART", b"0,CONNECT\r\n\r\nOK\r\n")
+    link_id = esp.allocate_link()
+    assert esp.socket_connect("TCP", "10.0.0.1", 80, link_id=link_id)
+    assert esp.park_link(link_id, "10.0.0.1", 80)
+    uart.feed(b"ready\r\n")
+    assert esp.take_parked_link("10.0.0.1", 80, "TCP") is None
+    assert esp.allocate_link() == link_id  # back with the free ones
+
+
+def test_dns_cache_hits_and_expires(clock):
+    cache = DNSCache(ttl=60)
+    assert cache.get("example.com") is None
+    cache.put("example.com", "10.0.0.1")
+    assert cache.get("example.com") == "10.0.0.1"
+    clock.now += 60
+    assert cache.get("example.com") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_dns_cache_evicts_least_recently_used():
+    cache = DNSCache(size=2)
+    cache.put("a", "10.0.0.1")
+    cache.put("b", "10.0.0.2")
+    cache.get("a")
+    cache.put("c", "10.0.0.3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "10.0.0.1"
+    assert cache.get("c") == "10.0.0.3"
+
+
+def test_dns_cache_off():
+    cache = DNSCache(size=0)
+    cache.put("a", "10.0.0.1")
+    assert cache.get("a") is None
+
+
+def test_dns_cache_failures_raise_fresh_errors(clock):
+    cache = DNSCache(negative_ttl=10)
+    cache.put("nowhere", OKError("No OK response to AT+CIPDOMAIN"))
+    raised = []
+    for _ in range(3):
+        with pytest.raises(OKError, match="CIPDOMAIN") as info:
+            cache.get("nowhere")
+        raised.append(info.value)
+    assert raised[0] is not raised[1]
+    frames = [len(traceback.extract_tb(error.__traceback__)) for error in raised]
+    assert frames[0] == frames[2]  # not growing with every hit
+    clock.now += 10
+    assert cache.get("nowhere") is None
+
+
+def test_nslookup_uses_the_cache(esp, uart):
+    esp.set_retry_policy("AT+CIPDOMAIN", RetryPolicy(attempts=1))
+    uart.respond(b'AT+CIPDOMAIN="nowhere"', b"ERROR\r\n")
+    assert esp.nslookup("example.com") == "10.0.0.1"
+    assert esp.nslookup("example.com") == "10.0.0.1"
+    for _ in range(2):
+        with pytest.raises(OKError):
+            esp.nslookup("nowhere")
+    lookups = [command for command in uart.commands if command.startswith(b"AT+CIPDOMAIN")]
+    assert len(lookups) == 2
+
+
+def test_retry_backoff_is_capped():
+    policy = RetryPolicy(delay=1, backoff=2, max_delay=5)
+    assert [policy.wait_time(failures) for failures in range(1, 6)] == [1, 2, 4, 5, 5]
+
+
+def test_retry_jitter_only_shortens(monkeypatch):
+    policy = RetryPolicy(delay=4, jitter=0.5)
+    monkeypatch.setattr(random, "random", lambda: 0.0)
+    assert policy.wait_time(1) == 4
+    monkeypatch.setattr(random, "random", lambda: 1.0)
+    assert policy.wait_time(1) == 2
+
+
+def test_retry_gives_up_after_attempts_and_reports():
+    reports = []
+    policy = RetryPolicy(attempts=3, delay=1, backoff=2, report=lambda *args: reports.append(args))
+    retry = policy.start("AT+GMR")
+    assert [retry.next_delay() for _ in range(3)] == [1, 2, None]
+    assert reports == [("AT+GMR", 3, 3)]
+    retry = policy.start("AT+GMR", attempts=1)  # the call's own limit wins
+    assert retry.next_delay() is None
+
+
+def test_retry_success_reports_tries():
+    reports = []
+    retry = RetryPolicy(delay=0, report=lambda *args: reports.append(args)).start("begin")
+    retry.next_delay()
+    retry.done()
+    assert reports == [("begin", 2, 0)]
+
+
+def test_retry_without_attempt_limit_keeps_going():
+    retry = RetryPolicy(attempts=None, delay=0).start("connect")
+    assert all(retry.next_delay() == 0 for _ in range(100))
+
+
+def test_retry_deadline_trims_the_last_wait(clock):
+    retry = RetryPolicy(attempts=None, delay=3, deadline=5).start("socket_connect")
+    assert retry.next_delay() == 3
+    clock.now += 4
+    assert retry.next_delay() == 1
+    clock.now += 1
+    assert retry.next_delay() is None
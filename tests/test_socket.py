@@ -0,0 +1,54 @@
+# SPDX-FileCopyrightText: 2026 Adafruit Industries
+#
+# SPDX-License-Identifier: MIT
+
+"""The socket module on top of ESP_ATcontrol"""
+
+import time
+
+from adafruit_espatcontrol.adafruit_espatcontrol import ESP_ATcontrol
+from adafruit_espatcontrol.adafruit_espatcontrol_socket import SocketPool
+
+
+def test_recv_returns_what_is_there(esp, uart):
+    sock = SocketPool(esp).socket()
+    sock.settimeout(2)
+    sock.connect(("10.0.0.1", 80), "TCP")
+    uart.feed(b"+IPD,5:hello")
+    start = time.monotonic()
+    assert sock.recv(10) == b"hello"
+    assert time.monotonic() - start < 1
+
+
+def test_closing_an_unconnected_socket_leaves_other_links_alone(uart):
+    esp = ESP_ATcontrol(uart, 115200, multi_link=True)
+    uart.respond(b"AT+CIPSTART", b"0,CONNECT\r\n\r\nOK\r\n")
+    pool = SocketPool(esp)
+    connected = pool.socket()
+    connected.connect(("10.0.0.1", 80), "TCP")
+    pool.socket().close()
+    connected.close()
+    connected.close()
+    assert uart.commands.count(b"AT+CIPCLOSE=0") == 1
+
+
+def test_closing_a_parked_socket_again_keeps_the_pool_link(uart):
+    esp = ESP_ATcontrol(uart, 115200, multi_link=True, link_pool_size=2)
+    uart.respond(b"AT+CIPSTART", b"0,CONNECT\r\n\r\nOK\r\n")
+    sock = SocketPool(esp).socket()
+    sock.settimeout(0.1)
+    sock.connect(("10.0.0.1", 80), "TCP")
+    sock.close()  # parked
+    sock.close()
+    assert b"AT+CIPCLOSE=0" not in uart.commands
+    assert esp.take_parked_link("10.0.0.1", 80, "TCP") == 0
+
+
+def test_disconnecting_a_parked_link_releases_it(uart):
+    esp = ESP_ATcontrol(uart, 115200, multi_link=True, link_pool_size=1)
+    uart.respond(b"AT+CIPSTART", b"0,CONNECT\r\n\r\nOK\r\n")
+    link_id = esp.allocate_link()
+    esp.socket_connect("TCP", "10.0.0.1", 80, link_id=link_id)
+    esp.park_link(link_id, "10.0.0.1", 80)
+    esp.socket_disconnect(link_id)
+    assert [esp.allocate_link() for _ in range(esp.MAX_LINKS)] == list(range(esp.MAX_LINKS))
@@ -0,0 +1,14 @@
+# SPDX-FileCopyrightText: 2026 Adafruit Industries
+#
+# SPDX-License-Identifier: MIT
+
+"""ESPAT_WiFiManager setup"""
+
+from adafruit_espatcontrol import adafruit_espatcontrol_socket
+from adafruit_espatcontrol.adafruit_espatcontrol_wifimanager import ESPAT_WiFiManager
+
+
+def test_manager_sets_the_socket_interface(esp):
+    ESPAT_WiFiManager(esp, {})
+    # module level socket functions still work after making a manager
+    assert adafruit_espatcontrol_socket._the_interface is esp